@@ -1,23 +1,200 @@
 import os
+import sys
 from shutil import which
 import argparse
 import configparser
 import subprocess
 import urllib.parse as urlparse
 import shutil
+import re
+import json
+import time
+import asyncio
+import signal
+import fcntl
+import glob
+import threading
+import collections
+import contextlib
+import queue
+import atexit
+import sqlite3
+import hashlib
+import mmap
+import ctypes
+import socket
+import socketserver
+import traceback
+import select
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 
-BINARY_STEAMCMD = "steamcmd"
+BINARY_STEAMCMD = os.getenv("ARMA3_STEAMCMD", "steamcmd")
+BINARY_ARMA3SERVER = os.getenv("ARMA3_SERVER_BINARY", "./arma3server")
 CONFIG_FILE_MAIN_DIR = os.getenv("HOME") + "/.config/arma3_wrapper"
 CONFIG_FILE_MAIN_FILE = "config.ini"
 CONFIG_FILE_MAIN = CONFIG_FILE_MAIN_DIR + "/" + CONFIG_FILE_MAIN_FILE
 CONFIG_FILE_SERVER = "config.ini"
+SERVER_CFG_TEMPLATE = os.path.dirname(os.path.abspath(__file__)) + "/server.cfg.template"  # not relative to the cwd, which is the daemon's for a job
+STATE_DB = CONFIG_FILE_MAIN_DIR + "/state.db"
 
 STEAM_ARMA3_DEDSERVER_CODE = "233780"
 STEAM_ARMA3_WORKSHOP_CODE = "107410"
+STEAM_WORKSHOP_APP_CODE = "766"  # the app workshop collections belong to
 SERVER_MOD_DIR = "steamapps/workshop/content/" + STEAM_ARMA3_WORKSHOP_CODE + "/"
-
-ALLOWED_INSTANCE_PARAM_FIELDS = [ "path", "mods", "port" ]
+SERVER_MOD_DOWNLOADS_DIR = "steamapps/workshop/downloads/" + STEAM_ARMA3_WORKSHOP_CODE + "/"  # steamcmd's partial downloads
+SERVER_STAGING_DIR = ".staging"
+SERVER_WORKSHOP_ACF = "steamapps/workshop/appworkshop_" + STEAM_ARMA3_WORKSHOP_CODE + ".acf"
+SERVER_MOD_MANIFEST = "mods.manifest"
+SERVER_LOWERCASE_INDEX = "lowercase.index"
+SERVER_MOD_CACHE = "mods.cache"
+SERVER_INSTANCE_STATE = "instances.state"
+SERVER_VERSIONS_DIR = "versions"
+SERVER_CURRENT_LINK = "current"
+SERVER_PREVIOUS_LINK = "previous"
+SERVER_LINKS_DIR = "links"
+SERVER_KEYS_DIR = "keys"
+SERVER_HASH_DIR = "hashes"
+SERVER_HASH_MANIFEST = SERVER_HASH_DIR + "/server.json"
+MOD_HASH_DIR = SERVER_HASH_DIR + "/mods"
+SERVER_STATE_EXCLUDE = ["instances", SERVER_VERSIONS_DIR, SERVER_CURRENT_LINK, SERVER_PREVIOUS_LINK, SERVER_STAGING_DIR, SERVER_INSTANCE_STATE, SERVER_INSTANCE_STATE + ".lock"]
+INSTANCE_OUTPUT_LOG = "arma3server.log"
+INSTANCE_CONSOLE_LOG = "server_console.log"  # logFile in server.cfg.template
+INSTANCE_HEADLESS_LOG = "headless%d.log"
+INSTANCE_LOG_STATS = "logstats.json"
+SERVER_HASH_EXCLUDE = SERVER_STATE_EXCLUDE + ["steamapps", SERVER_LINKS_DIR, SERVER_HASH_DIR, CONFIG_FILE_SERVER, SERVER_MOD_MANIFEST, SERVER_LOWERCASE_INDEX, SERVER_MOD_CACHE, INSTANCE_CONSOLE_LOG]
+
+PROC_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PROC_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+PREWARM_WORKERS = 8
+
+try:
+    LIBC = ctypes.CDLL(None, use_errno=True)
+    LIBC.mmap.restype = ctypes.c_void_p
+    LIBC.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+    LIBC.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    LIBC.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_void_p]
+except (OSError, AttributeError):
+    LIBC = None  # no mincore, prewarming can't tell what's already cached
+
+LOG_CHUNK_SIZE = 65536
+LOG_MAX_LINE = 65536  # longer lines are cut so a runaway line can't eat memory
+LOG_LOW_FPS = 20  # server fps below this counts as a collapse
+LOG_RECENT_ERRORS = 10
+LOG_PATTERNS = [
+    ("fps", re.compile(r"Server load: FPS (?P<fps>\d+), memory used: (?P<memory>\d+) MB(?:.*Players: (?P<players>\d+))?")),
+    ("connect", re.compile(r"Player (?P<player>.+?) connected(?: \(id=(?P<uid>\w+)\))?\.")),
+    ("disconnect", re.compile(r"Player (?P<player>.+?) disconnected\.")),
+    ("mission", re.compile(r"Mission (?P<mission>.+?) read from (?:bank|directory)")),
+    ("script_error", re.compile(r"Error in expression <(?P<expression>.*)"))
+]
+LOG_TIME = re.compile(r"^\s*(\d{1,2}:\d{2}:\d{2}) ")
+# the server writes the same lines to several logs, each event type is only taken from the first of these that exists
+LOG_EVENT_SOURCES = {
+    "fps": ["rpt", "output", "console"],
+    "connect": ["console", "rpt", "output"],
+    "disconnect": ["console", "rpt", "output"],
+    "mission": ["console", "rpt", "output"],
+    "script_error": ["rpt", "output", "console"]
+}
+
+SUPERVISOR_BACKOFF_BASE = 5  # seconds before the first restart of a crashed instance
+SUPERVISOR_BACKOFF_MAX = 300
+SUPERVISOR_BACKOFF_RESET = 600  # an instance that ran this long is considered healthy again
+STEAM_RETRY_ATTEMPTS = 3
+STEAM_RETRY_BACKOFF = 10  # seconds before the first retry of failed items, doubled for each further one
+
+SUPERVISOR_STOP_TIMEOUT = 30  # seconds to wait after SIGTERM before killing an instance
+SUPERVISOR_START_TIMEOUT = 60  # seconds a rolling restart waits for an instance to come back
+
+STORE_REFS = "refs.json"
+STORE_LOCK = ".lock"
+
+STEAM_API_FILE_DETAILS = "https://api.steampowered.com/ISteamRemoteStorage/GetPublishedFileDetails/v1/"
+STEAM_API_COLLECTION_DETAILS = "https://api.steampowered.com/ISteamRemoteStorage/GetCollectionDetails/v1/"
+
+WORKSHOP_CACHE = CONFIG_FILE_MAIN_DIR + "/workshop.cache.json"
+WORKSHOP_CACHE_TTL = 24 * 3600
+WORKSHOP_FIXTURE = os.getenv("ARMA3_WORKSHOP_FIXTURE")  # JSON file to read workshop metadata from instead of steam
+
+STEAM_PROMPT = b"Steam>"
+STEAM_GUARD_PROMPTS = [b"Steam Guard code:", b"Two-factor code:"]
+STEAM_PASSWORD_PROMPT = b"password:"
+STEAM_SESSION_TIMEOUT = 1800  # seconds a steamcmd session may go without any output before it's given up on
+STEAM_LOGIN_FAILURE = re.compile(r"FAILED (?:login|with result code)|Login Failure")
+STEAM_APP_SUCCESS = re.compile(r"Success! App '" + STEAM_ARMA3_DEDSERVER_CODE + "' (?:fully installed|already up to date)")
+STEAM_MOD_SUCCESS = re.compile(r"Success\. Downloaded item (\d+)")
+STEAM_MOD_FAILURE = re.compile(r"ERROR! (?:Download item (\d+) failed|Timeout downloading item (\d+))")
+STEAM_MOD_START = re.compile(r"Downloading item (\d+)")
+STEAM_MOD_BYTES = re.compile(r"\((\d+) bytes\)")
+STEAM_APP_PROGRESS = re.compile(r"Update state \(0x[0-9a-fA-F]+\) [\w ]+, progress: [\d.]+ \((\d+) / (\d+)\)")
+STEAM_APP_FAILURE = re.compile(r"(?:ERROR|Error)! (?:Failed to install app '" + STEAM_ARMA3_DEDSERVER_CODE + "'|App '" + STEAM_ARMA3_DEDSERVER_CODE + "' state is)")
+
+STEAM_TRACE_FILE = CONFIG_FILE_MAIN_DIR + "/steam.trace.jsonl"
+
+DAEMON_SOCKET = os.getenv("ARMA3_DAEMON_SOCKET", CONFIG_FILE_MAIN_DIR + "/daemon.sock")
+DAEMON_JOB_HISTORY = 50  # finished jobs kept for `daemon jobs` and `daemon follow`
+DAEMON_CONTEXT = threading.local()  # the job a daemon thread works for
+
+ALLOWED_INSTANCE_PARAM_FIELDS = [ "path", "mods", "port", "headless", "cores", "prewarm" ]
+
+CPU_PLAN_FILE = os.getenv("ARMA3_CPU_PLAN", CONFIG_FILE_MAIN_DIR + "/cpus.json")  # shared by every server on the host
+
+def readJsonFile(file, default):
+    if not os.path.isfile(file):
+        return default
+
+    with open(file, "r") as json_file:
+        try:
+            return json.load(json_file)
+        except ValueError:
+            return default
+
+def writeJsonFile(file, data, **kwargs):
+    # write to a temporary file first so readers never see half a file, one per thread as daemon jobs run side by side
+    tmp_file = "%s.%d.%d.tmp" % (file, os.getpid(), threading.get_ident())
+    with open(tmp_file, "w") as json_file:
+        json.dump(data, json_file, **kwargs)
+    os.replace(tmp_file, file)
+
+def getJob():
+    return getattr(DAEMON_CONTEXT, "job", None)
+
+def setJob(job):
+    DAEMON_CONTEXT.job = job
+
+def jobExecutor(workers):
+    # thread pool whose threads print and prompt through the daemon job that started it, if any
+    return ThreadPoolExecutor(max_workers=workers, initializer=setJob, initargs=(getJob(),))
+
+def prompt(text, secret=False):
+    # asks the user, through the client that submitted the job when running in the daemon
+    job = getJob()
+    if job is not None:
+        return job.ask(text, secret)
+
+    return getpass(text) if secret else input(text)
+
+def promptPath(text):
+    # asks for a path, a relative one is taken from where the command was run rather than the daemon's cwd
+    path = prompt(text)
+    if path == "":
+        return path
+
+    job = getJob()
+    cwd = job.cwd if job is not None and job.cwd is not None else os.getcwd()
+    return os.path.normpath(os.path.join(cwd, os.path.expanduser(path)))
+
+def atJobExit(callback):
+    # runs callback when the command is done, which for a daemon job isn't when the process exits
+    job = getJob()
+    if job is not None:
+        job.cleanup.append(callback)
+    else:
+        atexit.register(callback)
 
 def printSteamHeaderStart():
     print("\n####################")
@@ -29,88 +206,2374 @@ def printSteamHeaderEnd():
     print("SteamCMD Closed")
     print("####################\n")
 
-def getArmaServer(username, password, dir):
+class SteamTrace:
+    # follows steamcmd output as it streams in, timing every app and workshop item it downloads.
+    # each start and end is appended to a JSON lines file as it happens
+
+    def __init__(self, file, server=None):
+        self.file = file
+        self.server = server
+        self.run = int(time.time())
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def write(self, event, item):
+        record = {"event": event, "run": self.run, "server": self.server, "time": time.time(), "kind": item["kind"], "id": item["id"], "attempt": item["attempt"]}
+        if event == "end":
+            for key in ["success", "duration", "bytes", "throughput", "error"]:
+                record[key] = item[key]
+
+        with open(self.file, "a") as trace:
+            trace.write(json.dumps(record) + "\n")
+
+    def begin(self, kind, item_id):
+        with self.lock:
+            item = self.items.get(item_id)
+            if item is not None and item["success"] is None:
+                return  # already running, e.g. announced by steamcmd after we started it
+
+            attempt = item["attempt"] + 1 if item is not None else 1
+            item = {"kind": kind, "id": item_id, "attempt": attempt, "start": time.time(), "success": None, "duration": None, "bytes": 0, "throughput": None, "error": None}
+            self.items[item_id] = item
+            self.write("start", item)
+
+    def end(self, item_id, success, error=None, size=None):
+        with self.lock:
+            item = self.items.get(item_id)
+            if item is None or item["success"] is not None:
+                return
+
+            item["success"] = success
+            item["error"] = error
+            item["duration"] = time.time() - item["start"]
+            if size is not None:
+                item["bytes"] = size
+            item["throughput"] = item["bytes"] / item["duration"] if item["duration"] > 0 and item["bytes"] > 0 else None
+            self.write("end", item)
+
+    def feed(self, line):
+        match = STEAM_MOD_START.search(line)
+        if match:
+            self.begin("mod", match.group(1))
+            return
+
+        match = STEAM_MOD_SUCCESS.search(line)
+        if match:
+            size = STEAM_MOD_BYTES.search(line)
+            self.end(match.group(1), True, size=int(size.group(1)) if size else None)
+            return
+
+        match = STEAM_MOD_FAILURE.search(line)
+        if match:
+            self.end(match.group(1) or match.group(2), False, error=line.strip())
+            return
+
+        match = STEAM_APP_PROGRESS.search(line)
+        if match:
+            with self.lock:
+                if STEAM_ARMA3_DEDSERVER_CODE in self.items:
+                    self.items[STEAM_ARMA3_DEDSERVER_CODE]["bytes"] = int(match.group(1))
+        elif STEAM_APP_SUCCESS.search(line):
+            self.end(STEAM_ARMA3_DEDSERVER_CODE, True)
+        elif STEAM_APP_FAILURE.search(line):
+            self.end(STEAM_ARMA3_DEDSERVER_CODE, False, error=line.strip())
+
+    def close(self):
+        # anything steamcmd never finished counts as failed
+        for item_id in list(self.items):
+            self.end(item_id, False, error="no result from steamcmd")
+
+        printSteamTrace(self.items.values())
+
+def printSteamTrace(items):
+    items = sorted(items, key=lambda item: item["duration"] or 0, reverse=True)
+    if len(items) == 0:
+        return
+
+    print("Item\t\tStatus\tTime\tSize\t\tSpeed")
+    for item in items:
+        speed = formatSize(item["throughput"]) + "/s" if item["throughput"] is not None else "-"
+        status = ("OK" if item["success"] else "FAILED") + (" (attempt %d)" % item["attempt"] if item["attempt"] > 1 else "")
+        print("%s\t%s\t%.1fs\t%s\t%s" % (item["id"] if item["kind"] == "mod" else "server", status, item["duration"], formatSize(item["bytes"]), speed))
+        if item["error"] is not None:
+            print("\t\t" + item["error"])
+
+    failed = len([item for item in items if not item["success"]])
+    print("%d item(s) in %.1fs, %d failed" % (len(items), sum(item["duration"] for item in items), failed))
+
+def quoteSteamArg(arg):
+    return '"' + arg + '"'
+
+class SteamSession:
+    # a steamcmd kept running at its interactive prompt, so the bootstrap and login are paid only once
+
+    def __init__(self, username, password, prefix="", trace=None):
+        self.username = username
+        self.password = password
+        self.prefix = prefix
+        self.trace = trace
+        self.install_dir = None
+        self.logged_in = False
+        self.process = subprocess.Popen([BINARY_STEAMCMD], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.readUntilPrompt()
+
+    def readUntilPrompt(self, answers={}):
+        # echoes output up to the next Steam> prompt and returns it as lines, answering steam guard prompts and
+        # the prompts in answers on the way. a steamcmd that stays silent too long is killed
+        lines = []
+        partial = b""
+        while True:
+            ready, _, _ = select.select([self.process.stdout], [], [], STEAM_SESSION_TIMEOUT)
+            if len(ready) == 0:
+                self.process.kill()
+                self.process.wait()
+                raise EOFError("steamcmd didn't answer in %d seconds" % STEAM_SESSION_TIMEOUT)
+
+            chunk = os.read(self.process.stdout.fileno(), 4096)
+            if not chunk:
+                raise EOFError("steamcmd exited")
+
+            parts = (partial + chunk).replace(b"\r", b"\n").split(b"\n")
+            partial = parts.pop()
+            for part in parts:
+                line = part.decode("utf-8", "replace")
+                lines.append(line)
+                if line.strip() != "":
+                    print(self.prefix + line, flush=True)
+                if self.trace is not None:
+                    self.trace.feed(line)
+
+            if partial.strip().endswith(STEAM_PROMPT):
+                return lines
+
+            answer = next((answer for answer_prompt, answer in answers.items() if partial.strip().endswith(answer_prompt)), None)
+            if answer is None and any(partial.strip().endswith(prompt) for prompt in STEAM_GUARD_PROMPTS):
+                answer = prompt(partial.decode("utf-8", "replace").strip() + " ", secret=True)
+
+            if answer is not None:
+                partial = b""
+                self.process.stdin.write(answer.encode() + b"\n")
+                self.process.stdin.flush()
+
+    def run(self, command, answers={}):
+        self.process.stdin.write(command.encode() + b"\n")
+        self.process.stdin.flush()
+        return self.readUntilPrompt(answers)
+
+    def login(self):
+        # steamcmd's console has no escapes, a password with a quote in it is typed in at its password prompt instead
+        if '"' in self.password:
+            lines = self.run("login " + quoteSteamArg(self.username), {STEAM_PASSWORD_PROMPT: self.password})
+        else:
+            lines = self.run("login " + quoteSteamArg(self.username) + " " + quoteSteamArg(self.password))
+
+        self.logged_in = not any(STEAM_LOGIN_FAILURE.search(line) for line in lines)
+
+    def useInstallDir(self, dir):
+        # steamcmd only takes force_install_dir before logging in, so switching dirs means logging in again
+        if dir == self.install_dir and self.logged_in:
+            return True
+
+        if self.logged_in:
+            self.run("logout")
+            self.logged_in = False
+
+        self.run("force_install_dir " + quoteSteamArg(dir))
+        self.install_dir = dir
+        self.login()
+
+        return self.logged_in
+
+    def close(self):
+        try:
+            self.process.stdin.write(b"quit\n")
+            self.process.stdin.close()
+            self.process.wait(timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+class SteamSessionPool:
+    # hands out up to size logged in steamcmd sessions, reusing idle ones
+
+    def __init__(self, username, password, size=1):
+        self.username = username
+        self.password = password
+        self.size = size
+        self.idle = queue.Queue()
+        self.sessions = []
+        self.started = 0
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    @contextlib.contextmanager
+    def session(self, prefix="", trace=None):
+        # new sessions are started outside the lock so several can bootstrap at once
+        with self.lock:
+            create = self.idle.empty() and self.started < self.size
+            if create:
+                self.started += 1
+
+        if create:
+            try:
+                steam_session = SteamSession(self.username, self.password, prefix, trace)
+            except EOFError:
+                with self.lock:
+                    self.started -= 1
+                raise
+
+            with self.lock:
+                self.sessions.append(steam_session)
+        else:
+            steam_session = self.idle.get()
+            steam_session.prefix = prefix
+            steam_session.trace = trace
+
+        try:
+            yield steam_session
+        except EOFError:
+            # steamcmd died, replace it next time
+            with self.lock:
+                self.sessions.remove(steam_session)
+                self.started -= 1
+            raise
+        else:
+            self.idle.put(steam_session)
+
+    def close(self):
+        with self.lock:
+            for steam_session in self.sessions:
+                steam_session.close()
+            self.sessions = []
+            self.started = 0
+
+def getSteamPool(username, password, size):
+    # the daemon keeps its pools, and so its logged in steamcmds, from one job to the next
+    job = getJob()
+    if job is None:
+        return SteamSessionPool(username, password, size)
+
+    return job.daemon.getPool(job.server, username, password, size)
+
+def getArmaServer(username, password, dir, pool=None, validate=True, trace=None):
     
     printSteamHeaderStart()
 
-    # automated steamcmd command
-    steamcmd_run = subprocess.run(["steamcmd", "+login", username, password, "+force_install_dir", dir, "+app_update", STEAM_ARMA3_DEDSERVER_CODE, "validate", "+quit"])
+    app_update = ["app_update", STEAM_ARMA3_DEDSERVER_CODE] + (["validate"] if validate else [])
+    if trace is not None:
+        trace.begin("app", STEAM_ARMA3_DEDSERVER_CODE)
 
-    printSteamHeaderEnd
+    if pool is not None:
+        try:
+            with pool.session(trace=trace) as steam_session:
+                if not steam_session.useInstallDir(dir):
+                    return 1
 
-    return steamcmd_run.returncode
+                lines = steam_session.run(" ".join(app_update))
+        except EOFError:
+            lines = []
 
-def getSteamMods(username, password, mod_ids, dir):
-    
-    printSteamHeaderStart()
+        printSteamHeaderEnd()
+
+        return 0 if any(STEAM_APP_SUCCESS.search(line) for line in lines) else 1
 
     # automated steamcmd command
-    mod_requests = []
+    returncode, lines = runSteamCmd(["+force_install_dir", dir, "+login", username, password, "+" + app_update[0]] + app_update[1:] + ["+quit"], trace=trace)
+
+    printSteamHeaderEnd()
+
+    return returncode
+
+def runSteamCmd(args, prefix="", trace=None):
+    # runs steamcmd, echoing its output while keeping it for parsing
+    steamcmd_run = subprocess.Popen([BINARY_STEAMCMD] + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace")
+
+    lines = []
+    for line in steamcmd_run.stdout:
+        line = line.rstrip("\n")
+        lines.append(line)
+        print(prefix + line, flush=True)
+        if trace is not None:
+            trace.feed(line)
+
+    steamcmd_run.wait()
+
+    return steamcmd_run.returncode, lines
+
+def downloadSteamMods(username, password, mod_ids, dir, prefix="", pool=None, trace=None):
+    # downloads mod_ids into dir with a single steamcmd, returns {mod_id: success}
+    if pool is not None:
+        lines = []
+        try:
+            with pool.session(prefix, trace) as steam_session:
+                if steam_session.useInstallDir(dir):
+                    for mod_id in mod_ids:
+                        if trace is not None:
+                            trace.begin("mod", mod_id)
+                        lines += steam_session.run("workshop_download_item " + STEAM_ARMA3_WORKSHOP_CODE + " " + mod_id)
+        except EOFError:
+            pass  # whatever steamcmd didn't get to counts as failed
+    else:
+        mod_requests = []
+        for mod_id in mod_ids:
+            mod_requests.append("+workshop_download_item")
+            mod_requests.append(STEAM_ARMA3_WORKSHOP_CODE)
+            mod_requests.append(mod_id)
+
+        returncode, lines = runSteamCmd(["+force_install_dir", dir, "+login", username, password] + mod_requests + ["+quit"], prefix, trace)
+
+    results = {}
+    for line in lines:
+        match = STEAM_MOD_SUCCESS.search(line)
+        if match:
+            results[match.group(1)] = True
+            continue
+
+        match = STEAM_MOD_FAILURE.search(line)
+        if match:
+            results[match.group(1) or match.group(2)] = False
+
+    # steamcmd didn't say anything about these, which never happens for a download that worked
     for mod_id in mod_ids:
-        mod_requests.append("+workshop_download_item")
-        mod_requests.append(STEAM_ARMA3_WORKSHOP_CODE)
-        mod_requests.append(mod_id)
-    
-    steamcmd_run = subprocess.run(["steamcmd", "+login", username, password, "+force_install_dir", dir] + mod_requests + ["+quit"])
+        if mod_id not in results:
+            results[mod_id] = False
+            if trace is not None:
+                trace.begin("mod", mod_id)
+                trace.end(mod_id, False, error="no result from steamcmd")
+
+    return {mod_id: results[mod_id] for mod_id in mod_ids}
+
+def downloadSteamModsSharded(username, password, mod_ids, dir, workers, pool=None, trace=None):
+    # splits mods over the workers, each with its own staging install dir so they don't clash.
+    # a mod with a partial download in a staging dir goes back to that one so steamcmd resumes it
+    staging_root = dir + "/" + SERVER_STAGING_DIR
+    existing = sorted(os.listdir(staging_root)) if os.path.isdir(staging_root) else []
+    shards = {}
+    for n, mod_id in enumerate(mod_ids):
+        partial = [i for i in existing if os.path.isdir(staging_root + "/" + i + "/" + SERVER_MOD_DOWNLOADS_DIR + mod_id)]
+        shards.setdefault(partial[0] if len(partial) > 0 else str(n % workers), []).append(mod_id)
+
+    def runShard(i):
+        staging = staging_root + "/" + i
+        os.makedirs(staging, exist_ok=True)
+        return staging, downloadSteamMods(username, password, shards[i], staging, "[worker " + i + "] ", pool, trace)
+
+    with jobExecutor(workers) as executor:
+        shard_results = list(executor.map(runShard, shards))
+
+    # merge successful downloads into the server mod dir
+    os.makedirs(dir + "/" + SERVER_MOD_DIR, exist_ok=True)
+    results = {}
+    for staging, shard in shard_results:
+        mergeWorkshopAcf(dir, staging, [mod_id for mod_id, success in shard.items() if success])
+        for mod_id, success in shard.items():
+            src = staging + "/" + SERVER_MOD_DIR + mod_id
+            if success and os.path.isdir(src):
+                dest = dir + "/" + SERVER_MOD_DIR + mod_id
+                old = dest + ".old"
+                if os.path.isdir(dest):
+                    os.replace(dest, old)
+                os.replace(src, dest)
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                success = False
+
+            results[mod_id] = success
+
+        if all(shard.values()):
+            shutil.rmtree(staging, ignore_errors=True)
+
+    if os.path.isdir(staging_root) and len(os.listdir(staging_root)) == 0:
+        os.rmdir(staging_root)
+
+    return results
+
+def getSteamMods(username, password, mod_ids, dir, workers=1, pool=None, trace=None, on_success=None, isolated=False, lock=contextlib.nullcontext):
+    # downloads mod_ids into dir, retrying failed ones with backoff. on_success is called with the mods that
+    # made it after every round, so they can be kept even if others never do. isolated always downloads into
+    # staging dirs, so mods in dir are replaced whole and never written to in place. lock is held for each
+    # round and its on_success, but not while waiting to retry
+    mod_ids = [mod_id for mod_id in mod_ids if mod_id != ""]
+    if len(mod_ids) == 0:
+        return {}
+
+    printSteamHeaderStart()
+
+    results = {}
+    pending = mod_ids
+    for attempt in range(STEAM_RETRY_ATTEMPTS + 1):
+        if attempt > 0:
+            delay = STEAM_RETRY_BACKOFF * 2 ** (attempt - 1)
+            print("Retrying %d failed mod(s) in %d seconds" % (len(pending), delay))
+            time.sleep(delay)
+
+        with lock():
+            if not isolated and (workers <= 1 or (len(pending) == 1 and not os.path.isdir(dir + "/" + SERVER_STAGING_DIR))):
+                round_results = downloadSteamMods(username, password, pending, dir, pool=pool, trace=trace)
+            else:
+                round_results = downloadSteamModsSharded(username, password, pending, dir, min(workers, len(pending)), pool, trace)
+
+            results.update(round_results)
+            succeeded = [mod_id for mod_id in pending if round_results[mod_id]]
+            if on_success is not None and len(succeeded) > 0:
+                on_success(succeeded)
+
+        pending = [mod_id for mod_id in pending if not round_results[mod_id]]
+        if len(pending) == 0:
+            break
 
     printSteamHeaderEnd()
 
-    return steamcmd_run.returncode
+    return {mod_id: results[mod_id] for mod_id in mod_ids}
+
+def printModResults(results):
+    for mod_id, success in results.items():
+        print(mod_id + "\t\t" + ("OK" if success else "FAILED"))
 
-def startServer(path, profile, port, mods):
+    return all(results.values())
+
+def getServerCommand(profile, port, mods):
     configPath = profile + "/" + "server.cfg"
     modList = ";".join(mods)
-    arma3server_run = subprocess.run(["./arma3server", "-config=" + configPath, "-port=" + port, "-profiles=" + profile, "-mod=" + modList], cwd=path)
+    return [BINARY_ARMA3SERVER, "-config=" + configPath, "-port=" + port, "-profiles=" + profile, "-mod=" + modList]
 
-    return arma3server_run
+def getHeadlessProfile(profile, index):
+    # a headless client's own profile dir, so its rpt files don't mix with the server's
+    return profile + "/hc%d" % index
+
+def getInstancePassword(profile):
+    # the join password set in the instance's server.cfg, empty if there is none
+    try:
+        with open(profile + "/server.cfg", "r", errors="replace") as cfg:
+            match = re.search(r'^\s*password\s*=\s*"([^"]*)"', cfg.read(), re.MULTILINE)
+    except OSError:
+        return ""
+
+    return match.group(1) if match else ""
 
-def lowercase_all(dir):
-    # renames all subforders of dir, not including dir itself
-    def rename_all(root, items):
-        for name in items:
+def getHeadlessCommand(profile, port, mods, index):
+    modList = ";".join(mods)
+    command = [BINARY_ARMA3SERVER, "-client", "-connect=127.0.0.1", "-port=" + port, "-profiles=" + getHeadlessProfile(profile, index), "-name=hc%d" % index, "-mod=" + modList]
+    password = getInstancePassword(profile)
+    if password != "":
+        command.append("-password=" + password)
+
+    return command
+
+def getInstanceCpus(serverconfig, instance):
+    # number of headless clients and cores per process of an instance, no cores leaves its processes unpinned
+    return int(serverconfig[instance].get('headless', fallback="0")), int(serverconfig[instance].get('cores', fallback="0"))
+
+def getInstancePrewarm(serverconfig, instance):
+    # page cache budget for prewarming the instance's mods in bytes, given in MB. 0 turns it off
+    return int(serverconfig[instance].get('prewarm', fallback="0")) * 1024 * 1024
+
+def allocateCpus(key, counts):
+    # reserves cores in the host-wide plan that no other instance has, returns {process: [cpus]}.
+    # a process that doesn't fit gets no cores and runs unpinned
+    os.makedirs(os.path.dirname(CPU_PLAN_FILE), exist_ok=True)
+    with open(CPU_PLAN_FILE + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        plan = {name: entry for name, entry in readJsonFile(CPU_PLAN_FILE, {}).items() if isPidAlive(entry["owner"]) and name != key}
+        used = set(cpu for entry in plan.values() for cpus in entry["cpus"].values() for cpu in cpus)
+        free = [cpu for cpu in sorted(os.sched_getaffinity(0)) if cpu not in used]
+
+        allocation = {process: [] for process in counts}
+        for process, count in counts.items():
+            if count <= 0:
+                continue  # not pinned
+
+            if len(free) < count:
+                print("Not enough free cores to pin %s of %s, running it unpinned" % (process, key))
+                continue
+
+            allocation[process] = free[:count]
+            free = free[count:]
+
+        if any(len(cpus) > 0 for cpus in allocation.values()):
+            plan[key] = {"owner": os.getpid(), "cpus": {process: cpus for process, cpus in allocation.items() if len(cpus) > 0}}
+        writeJsonFile(CPU_PLAN_FILE, plan, indent=1)
+
+    return allocation
+
+def releaseCpus(key):
+    with open(CPU_PLAN_FILE + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        plan = readJsonFile(CPU_PLAN_FILE, {})
+        if plan.get(key, {}).get("owner") == os.getpid():
+            del plan[key]
+            writeJsonFile(CPU_PLAN_FILE, plan, indent=1)
+
+def allocateInstanceCpus(dir, instance, headless, cores):
+    counts = {"server": cores}
+    for index in range(headless):
+        counts["hc%d" % index] = cores
+
+    return allocateCpus(dir + ":" + instance, counts)
+
+def pinCpus(cpus):
+    # preexec_fn that pins the child before it starts any threads
+    if len(cpus) == 0:
+        return None
+
+    return lambda: os.sched_setaffinity(0, cpus)
+
+def syncLinks(dir, wanted, owned=lambda target: True):
+    # makes the symlinks in dir match wanted {name: target}, only touching links that changed.
+    # links whose target isn't owned and anything that isn't a link are left alone
+    missing = dict(wanted)
+    with os.scandir(dir) as it:
+        for item in it:
+            if not item.is_symlink():
+                missing.pop(item.name, None)
+                continue
+
+            target = os.readlink(item.path)
+            if not owned(target):
+                missing.pop(item.name, None)
+            elif missing.get(item.name) == target:
+                del missing[item.name]
+            elif item.name not in wanted:
+                os.unlink(item.path)
+
+    for name, target in missing.items():
+        setLink(dir + "/" + name, target)
+
+def getModLinkName(name, mod_id):
+    link = re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+    return "@" + (link if link != "" else mod_id)
+
+def syncInstanceLinks(dir, serverconfig, instance):
+    # short @name links to the instance's mods, with dependencies first. returns their paths for -mod, relative to the server dir
+    live = getLiveDir(dir)
+    links_dir = SERVER_LINKS_DIR + "/" + instance
+    os.makedirs(live + "/" + links_dir, exist_ok=True)
+
+    mod_ids = splitMods(serverconfig[instance]['mods'])
+    workshop = readJsonFile(WORKSHOP_CACHE, {})
+    for mod_id in mod_ids:
+        for dependency in workshop.get(mod_id, {}).get("children", []):
+            if dependency not in mod_ids:
+                print("Mod %s of instance %s requires %s, which isn't enabled" % (mod_id, instance, dependency))
+
+    cache = readModCache(live)
+    cache_changed = False
+    wanted = {}
+    for mod_id in sortModsByDependencies(mod_ids, workshop):
+        info, changed = getModInfo(live, mod_id, cache)
+        cache_changed = cache_changed or changed
+
+        name = getModLinkName(info["name"], mod_id)
+        if name in wanted:
+            name += "_" + mod_id
+        wanted[name] = "../../" + SERVER_MOD_DIR + mod_id
+
+    if cache_changed:
+        writeModCache(live, cache)
+
+    syncLinks(live + "/" + links_dir, wanted)
+
+    return [links_dir + "/" + name for name in wanted]
+
+def getModKeys(path):
+    # .bikey files a mod ships, relative to the mod. mods are lowercased so the folder is key or keys
+    return [os.path.relpath(key, path) for key in glob.glob(path + "/*.bikey") + glob.glob(path + "/key*/*.bikey")]
+
+def syncServerKeys(dir, serverconfig):
+    # links the keys of every mod an instance uses into the server's keys folder, the server's own keys are left alone.
+    # arma only reads the keys folder of the installation, so this is shared by all instances
+    live = getLiveDir(dir)
+    keys_dir = live + "/" + SERVER_KEYS_DIR
+    os.makedirs(keys_dir, exist_ok=True)
+
+    prefix = "../" + SERVER_MOD_DIR
+    wanted = {}
+    for instance in getInstances(serverconfig):
+        for mod_id in splitMods(serverconfig[instance]['mods']):
+            for key in getModKeys(live + "/" + SERVER_MOD_DIR + mod_id):
+                wanted.setdefault(os.path.basename(key), prefix + mod_id + "/" + key)
+
+    syncLinks(keys_dir, wanted, lambda target: target.startswith(prefix))
+
+def getInstances(serverconfig):
+    return [header for header in serverconfig.keys() if header != "general" and header != "server" and header != "DEFAULT"]
+
+def getLiveDir(dir):
+    # the server files instances run from, a versioned copy once staged updates are used
+    link = dir + "/" + SERVER_CURRENT_LINK
+    return os.path.realpath(link) if os.path.islink(link) else dir
+
+def cloneFile(src, dest):
+    # a copy-on-write clone where the filesystem supports it, a plain copy otherwise
+    try:
+        with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+            fcntl.ioctl(dest_file.fileno(), getattr(fcntl, "FICLONE", 0x40049409), src_file.fileno())
+        shutil.copystat(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+def cloneTree(src, dest, exclude=[], link=[]):
+    # copies src to dest. files below the paths in link are hardlinked instead, for files that are only ever
+    # replaced whole. returns the size and mtime of every hardlinked file, to check nothing wrote to them in place
+    linked = {}
+
+    def walk(src_path, dest_path, rel, hardlink):
+        os.makedirs(dest_path, exist_ok=True)
+        with os.scandir(src_path) as it:
+            for item in it:
+                item_rel = rel + item.name
+                if item_rel in exclude:
+                    continue
+
+                if item.is_symlink():
+                    os.symlink(os.readlink(item.path), dest_path + "/" + item.name)
+                elif item.is_dir():
+                    walk(item.path, dest_path + "/" + item.name, item_rel + "/", hardlink or item_rel in link)
+                elif hardlink:
+                    os.link(item.path, dest_path + "/" + item.name)
+                    item_stat = item.stat()
+                    linked[item_rel] = [item_stat.st_size, item_stat.st_mtime_ns]
+                else:
+                    cloneFile(item.path, dest_path + "/" + item.name)
+
+    walk(src, dest, "", False)
+
+    return linked
+
+def getChangedFiles(root, files):
+    # the files whose size or mtime differ from files, as returned by cloneTree
+    changed = []
+    for rel, stamp in files.items():
+        try:
+            file_stat = os.stat(root + "/" + rel)
+        except OSError:
+            continue  # replaced or deleted, which leaves the other link alone
+
+        if [file_stat.st_size, file_stat.st_mtime_ns] != stamp:
+            changed.append(rel)
+
+    return changed
+
+def stageServerVersion(dir, exclude):
+    # copy of the live server files for an update to work on while instances keep running. mods are hardlinked,
+    # staged updates download them into fresh dirs that replace the old ones whole. returns the copy and its
+    # hardlinked files
+    version = time.strftime("%Y%m%d-%H%M%S")
+    staging = dir + "/" + SERVER_VERSIONS_DIR + "/" + version
+    suffix = 1
+    while os.path.exists(staging):
+        suffix += 1
+        staging = dir + "/" + SERVER_VERSIONS_DIR + "/" + version + "-" + str(suffix)
+
+    try:
+        linked = cloneTree(getLiveDir(dir), staging, exclude, [SERVER_MOD_DIR.rstrip("/")])
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    return staging, linked
+
+def setLink(path, target):
+    # replaces the symlink at path in one step, so nothing ever sees it missing
+    os.symlink(target, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def switchServerVersion(dir, version_dir):
+    current = dir + "/" + SERVER_CURRENT_LINK
+    setLink(dir + "/" + SERVER_PREVIOUS_LINK, os.readlink(current) if os.path.islink(current) else ".")
+    setLink(current, os.path.relpath(version_dir, dir))
+
+def rollbackServerVersion(dir):
+    # swaps the current and previous versions, returns False if there is nothing to roll back to
+    current = dir + "/" + SERVER_CURRENT_LINK
+    previous = dir + "/" + SERVER_PREVIOUS_LINK
+    if not os.path.islink(previous):
+        return False
+
+    previous_target = os.readlink(previous)
+    setLink(previous, os.readlink(current) if os.path.islink(current) else ".")
+    setLink(current, previous_target)
+
+    return True
+
+def getProcessCwds():
+    # working directories of every process we can see
+    cwds = set()
+    for pid in os.listdir("/proc"):
+        if pid.isdigit():
             try:
-                os.rename(os.path.join(root, name), os.path.join(root, name.lower()))
+                cwds.add(os.readlink("/proc/" + pid + "/cwd"))
             except OSError:
-                pass # can't rename it, so what
+                pass
 
-    # starts from the bottom so paths further up remain valid after renaming
-    for root, dirs, files in os.walk(dir, topdown=False):
-        rename_all(root, dirs)
-        rename_all(root, files)
+    return cwds
+
+def pruneServerVersions(dir):
+    # only the current and previous versions are kept, and any a process still runs in, e.g. an unsupervised instance
+    versions = dir + "/" + SERVER_VERSIONS_DIR
+    if not os.path.isdir(versions):
+        return
+
+    keep = [getLiveDir(dir), os.path.realpath(dir + "/" + SERVER_PREVIOUS_LINK)]
+    cwds = getProcessCwds()
+    for version in os.listdir(versions):
+        path = os.path.realpath(versions + "/" + version)
+        if path in keep:
+            continue
+
+        if any(cwd == path or cwd.startswith(path + "/") for cwd in cwds):
+            print("Keeping version " + version + ", it is still in use")
+            continue
+
+        shutil.rmtree(versions + "/" + version)
+
+def restartInstancesRolling(dir):
+    # restarts supervised instances one after another, waiting for each to come back before the next
+    for instance, state in readInstanceState(dir).items():
+        if getInstanceStatus(state) != "running":
+            continue
+
+        if not isPidAlive(state.get("supervisor")):
+            print("Instance %s isn't supervised, restart it yourself to use the new version" % instance)
+            continue
+
+        updateInstanceState(dir, instance, desired="restart")
+        os.kill(state["pid"], signal.SIGTERM)
+        print("Restarting instance " + instance)
+
+        deadline = time.time() + SUPERVISOR_STOP_TIMEOUT + SUPERVISOR_START_TIMEOUT
+        while time.time() < deadline:
+            new_state = readInstanceState(dir).get(instance, {})
+            if new_state.get("status") == "running" and new_state.get("pid") != state["pid"] and isPidAlive(new_state.get("pid")):
+                print("Instance %s is back up" % instance)
+                break
+            time.sleep(1)
+        else:
+            print("Instance %s didn't come back in time, continuing" % instance)
+
+def startServer(path, profile, port, mods, instance=None, headless=0, cores=0, prewarm=0):
+    if prewarm > 0:
+        printPrewarm(instance, prewarmMods(getLiveDir(path), mods, prewarm))
+
+    cpus = allocateInstanceCpus(path, instance, headless, cores) if instance is not None else {"server": []}
+    arma3server_run = subprocess.Popen(getServerCommand(profile, port, mods), cwd=getLiveDir(path), preexec_fn=pinCpus(cpus["server"]))
+
+    if instance is not None:
+        updateInstanceState(path, instance, pid=arma3server_run.pid, status="running", started=int(time.time()), supervisor=None, desired="running", cpus=cpus["server"])
+
+    headless_runs = []
+    for index in range(headless):
+        os.makedirs(getHeadlessProfile(profile, index), exist_ok=True)
+        with open(profile + "/" + INSTANCE_HEADLESS_LOG % index, "ab") as output:
+            headless_runs.append(subprocess.Popen(getHeadlessCommand(profile, port, mods, index), cwd=getLiveDir(path), stdout=output, stderr=subprocess.STDOUT, preexec_fn=pinCpus(cpus["hc%d" % index])))
+        print("Started headless client %d (pid %d)" % (index, headless_runs[-1].pid))
+
+    try:
+        arma3server_run.wait()
+    except KeyboardInterrupt:
+        arma3server_run.terminate()
+        arma3server_run.wait()
+
+    # headless clients have nothing to connect to without the server
+    for headless_run in headless_runs:
+        headless_run.terminate()
+    for headless_run in headless_runs:
+        headless_run.wait()
+
+    if instance is not None:
+        updateInstanceState(path, instance, pid=None, status="stopped")
+        releaseCpus(path + ":" + instance)
+
+    return arma3server_run
+
+@contextlib.contextmanager
+def lockInstanceState(dir):
+    with open(dir + "/" + SERVER_INSTANCE_STATE + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def updateInstanceState(dir, instance, **fields):
+    # read-modify-write of the instance state file under an exclusive lock, returns the instance's new state
+    with lockInstanceState(dir):
+        state = readInstanceState(dir)
+        state.setdefault(instance, {}).update(fields)
+        writeJsonFile(dir + "/" + SERVER_INSTANCE_STATE, state, indent=1)
+
+    return state[instance]
+
+def claimInstance(dir, instance, **fields):
+    # updates the instance's state like updateInstanceState, unless a supervisor or server of it is still alive.
+    # returns the pid of that process, None if the instance was claimed
+    with lockInstanceState(dir):
+        state = readInstanceState(dir)
+        current = state.get(instance, {})
+        for pid in [current.get("supervisor"), current.get("pid")]:
+            if isPidAlive(pid):
+                return pid
+
+        state.setdefault(instance, {}).update(fields)
+        writeJsonFile(dir + "/" + SERVER_INSTANCE_STATE, state, indent=1)
 
-def getServerPathFromName(name, serverlist):
-    SERVER_NAME = None
-    for server in serverlist:
-        serverconfig = configparser.ConfigParser()
-        conffile = server + "/config.ini"
-        if not os.path.isfile(conffile):
-            return None
-        
-        serverconfig.read(server + "/config.ini")
-        SERVER_DIR = serverconfig['general']['path']
-        SERVER_NAME = serverconfig['general']['name']
-        if SERVER_NAME == name:
-            return SERVER_DIR
-    
     return None
 
-def getModName(dir):
+def readInstanceState(dir):
+    return readJsonFile(dir + "/" + SERVER_INSTANCE_STATE, {})
+
+def isPidAlive(pid):
+    if pid is None:
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, but belongs to someone else
+
+    return True
+
+def getInstanceStatus(state):
+    # the recorded status, unless the recorded process has died without anyone noticing
+    if state.get("status") == "running" and not isPidAlive(state.get("pid")):
+        return "dead"
+
+    return state.get("status", "stopped")
+
+async def stopProcess(process, wait_exit):
+    # stop gracefully and kill if it takes too long
+    process.terminate()
+    try:
+        await asyncio.wait_for(wait_exit, SUPERVISOR_STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+async def superviseHeadless(dir, instance, profile, port, mods, index, cpus):
+    # keeps one headless client of an instance running until it's cancelled along with its server
+    while True:
+        try:
+            os.makedirs(getHeadlessProfile(profile, index), exist_ok=True)
+            with open(profile + "/" + INSTANCE_HEADLESS_LOG % index, "ab") as output:
+                process = await asyncio.create_subprocess_exec(*getHeadlessCommand(profile, port, mods, index), cwd=getLiveDir(dir), stdout=output, stderr=subprocess.STDOUT, start_new_session=True, preexec_fn=pinCpus(cpus))
+        except OSError as error:
+            print("Headless client %d of instance %s could not be started (%s), retrying in %d seconds" % (index, instance, error, SUPERVISOR_BACKOFF_BASE))
+            await asyncio.sleep(SUPERVISOR_BACKOFF_BASE)
+            continue
+        print("Started headless client %d of instance %s (pid %d)" % (index, instance, process.pid))
+
+        wait_exit = asyncio.ensure_future(process.wait())
+        try:
+            returncode = await asyncio.shield(wait_exit)
+        except asyncio.CancelledError:
+            await stopProcess(process, wait_exit)
+            raise
+
+        print("Headless client %d of instance %s exited with code %d, restarting in %d seconds" % (index, instance, returncode, SUPERVISOR_BACKOFF_BASE))
+        await asyncio.sleep(SUPERVISOR_BACKOFF_BASE)
+
+async def superviseInstance(dir, instance, profile, port, mods, stopping, headless=0, cores=0, prewarm=0):
+    owner = claimInstance(dir, instance, desired="running", supervisor=os.getpid())
+    if owner is not None:
+        # a second server would fight the first for its port
+        print("Instance %s is already running (pid %d), not supervising it" % (instance, owner))
+        return
+
+    cpus = allocateInstanceCpus(dir, instance, headless, cores)
+    try:
+        await superviseServer(dir, instance, profile, port, mods, stopping, headless, cpus, prewarm)
+    finally:
+        releaseCpus(dir + ":" + instance)
+
+async def superviseServer(dir, instance, profile, port, mods, stopping, headless, cpus, prewarm):
+    failures = 0
+    while not stopping.is_set():
+        if readInstanceState(dir).get(instance, {}).get("desired") == "stopped":
+            break  # stopped while waiting to restart
+
+        if prewarm > 0:
+            printPrewarm(instance, await asyncio.get_running_loop().run_in_executor(None, prewarmMods, getLiveDir(dir), mods, prewarm))
+
+        started = time.time()
+        try:
+            with open(profile + "/" + INSTANCE_OUTPUT_LOG, "ab") as output:
+                process = await asyncio.create_subprocess_exec(*getServerCommand(profile, port, mods), cwd=getLiveDir(dir), stdout=output, stderr=subprocess.STDOUT, start_new_session=True, preexec_fn=pinCpus(cpus["server"]))
+        except OSError as error:
+            # e.g. a missing binary, retried like a crash while the other instances keep running
+            failures = await backoffInstance(dir, instance, stopping, failures, "could not be started (%s)" % error, returncode=None)
+            continue
+
+        updateInstanceState(dir, instance, pid=process.pid, status="running", started=int(started), supervisor=os.getpid(), desired="running", cpus=cpus["server"])
+        print("Started instance %s (pid %d)" % (instance, process.pid))
+
+        headless_tasks = [asyncio.ensure_future(superviseHeadless(dir, instance, profile, port, mods, index, cpus["hc%d" % index])) for index in range(headless)]
+
+        wait_exit = asyncio.ensure_future(process.wait())
+        wait_stop = asyncio.ensure_future(stopping.wait())
+        await asyncio.wait([wait_exit, wait_stop], return_when=asyncio.FIRST_COMPLETED)
+        wait_stop.cancel()
+
+        # headless clients follow the server, they're started again with it
+        for task in headless_tasks:
+            task.cancel()
+        await asyncio.gather(*headless_tasks, return_exceptions=True)
+
+        if not wait_exit.done():
+            # supervisor is shutting down
+            await stopProcess(process, wait_exit)
+
+            updateInstanceState(dir, instance, pid=None, status="stopped", supervisor=None)
+            print("Stopped instance " + instance)
+            return
+
+        returncode = wait_exit.result()
+        desired = readInstanceState(dir).get(instance, {}).get("desired")
+        if desired == "stopped":
+            updateInstanceState(dir, instance, pid=None, status="stopped", supervisor=None)
+            print("Instance %s was stopped" % instance)
+            return
+
+        if desired == "restart":
+            # asked to restart, e.g. by a rolling update, so no backoff
+            updateInstanceState(dir, instance, pid=None, status="restarting", desired="running")
+            print("Restarting instance " + instance)
+            continue
+
+        if returncode == 0:
+            # shut down on purpose, e.g. #shutdown by an admin
+            updateInstanceState(dir, instance, pid=None, status="stopped", supervisor=None, desired="stopped", returncode=0)
+            print("Instance %s shut down" % instance)
+            return
+
+        if time.time() - started >= SUPERVISOR_BACKOFF_RESET:
+            failures = 0
+
+        reason = "exited with code %d" % returncode if returncode > 0 else "was killed by signal %d" % -returncode
+        failures = await backoffInstance(dir, instance, stopping, failures, reason, returncode=returncode)
+
+    updateInstanceState(dir, instance, pid=None, status="stopped", supervisor=None)
+
+async def backoffInstance(dir, instance, stopping, failures, reason, **fields):
+    # records a failed run and waits before the next start, longer after every failure. returns the new failure count
+    delay = min(SUPERVISOR_BACKOFF_MAX, SUPERVISOR_BACKOFF_BASE * 2 ** failures)
+    restarts = readInstanceState(dir).get(instance, {}).get("restarts", 0) + 1
+    updateInstanceState(dir, instance, pid=None, status="backoff", restarts=restarts, **fields)
+    print("Instance %s %s, restarting in %d seconds" % (instance, reason, delay))
+
+    try:
+        await asyncio.wait_for(stopping.wait(), delay)
+    except asyncio.TimeoutError:
+        pass
+
+    return failures + 1
+
+async def superviseInstances(dir, instances):
+    # instances maps instance name to (profile, port, mods, headless, cores, prewarm)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(signum, stopping.set)
+
+    await asyncio.gather(*[superviseInstance(dir, instance, profile, port, mods, stopping, headless, cores, prewarm) for instance, (profile, port, mods, headless, cores, prewarm) in instances.items()])
+
+def getLogSources(dir, profile):
+    # name -> function returning the current file of that log, rpt files are replaced by a new one on every start.
+    # only the server's own rpt files count, headless clients write theirs to their own profile dirs
+    def newestRpt():
+        rpts = glob.glob(profile + "/*.rpt")
+        return max(rpts, key=os.path.getmtime) if len(rpts) > 0 else None
+
+    def consoleLog():
+        for path in [profile + "/" + INSTANCE_CONSOLE_LOG, getLiveDir(dir) + "/" + INSTANCE_CONSOLE_LOG]:
+            if os.path.isfile(path):
+                return path
+        return None
+
+    return {
+        "rpt": newestRpt,
+        "console": consoleLog,
+        "output": lambda: profile + "/" + INSTANCE_OUTPUT_LOG
+    }
+
+def readLogFile(path, position):
+    # yields the complete lines of path past position["offset"], keeping position current as it goes.
+    # a line longer than LOG_MAX_LINE is yielded cut and the rest of it is skipped as it's read, never kept
+    with open(path, "rb") as log:
+        log.seek(position["offset"])
+        partial = b""
+        while True:
+            chunk = log.read(LOG_CHUNK_SIZE)
+            if not chunk:
+                break
+
+            if position.get("skip"):
+                end = chunk.find(b"\n")
+                position["offset"] += len(chunk) if end == -1 else end + 1
+                if end == -1:
+                    continue
+                position["skip"] = False
+                chunk = chunk[end + 1:]
+
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                position["offset"] += len(line) + 1
+                yield line[:LOG_MAX_LINE].decode("utf-8", "replace").rstrip("\r")
+
+            if len(partial) > LOG_MAX_LINE:
+                position["offset"] += len(partial)
+                position["skip"] = True
+                yield partial[:LOG_MAX_LINE].decode("utf-8", "replace")
+                partial = b""
+
+def readLogLines(path, position):
+    # yields new lines of a log, following it across rotation and truncation
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return
+
+    if position.get("path") != path or position.get("ino") != stat.st_ino or stat.st_size < position.get("offset", 0):
+        # finish the old file if it's still around, then start the new one from the top
+        old_path = position.get("path")
+        if old_path is not None and old_path != path and os.path.isfile(old_path) and os.stat(old_path).st_ino == position.get("ino"):
+            yield from readLogFile(old_path, position)
+
+        position.clear()
+        position.update({"path": path, "ino": stat.st_ino, "offset": 0})
+
+    yield from readLogFile(path, position)
+
+def parseLogLine(line):
+    for event_type, pattern in LOG_PATTERNS:
+        match = pattern.search(line)
+        if match:
+            event = {"type": event_type}
+            event.update({key: value for key, value in match.groupdict().items() if value is not None})
+            time_match = LOG_TIME.match(line)
+            if time_match:
+                event["time"] = time_match.group(1)
+            return event
+
+    return None
+
+def newLogSummary():
+    return {
+        "fps_last": None, "fps_min": None, "fps_sum": 0, "fps_samples": 0, "fps_low": 0,
+        "players": [], "connects": 0, "disconnects": 0,
+        "mission": None, "missions": 0,
+        "script_errors": 0, "recent_errors": []
+    }
+
+def addLogEvent(summary, event):
+    if event["type"] == "fps":
+        fps = int(event["fps"])
+        summary["fps_last"] = fps
+        summary["fps_min"] = fps if summary["fps_min"] is None else min(summary["fps_min"], fps)
+        summary["fps_sum"] += fps
+        summary["fps_samples"] += 1
+        if fps < LOG_LOW_FPS:
+            summary["fps_low"] += 1
+    elif event["type"] == "connect":
+        summary["connects"] += 1
+        if event["player"] not in summary["players"]:
+            summary["players"].append(event["player"])
+    elif event["type"] == "disconnect":
+        summary["disconnects"] += 1
+        if event["player"] in summary["players"]:
+            summary["players"].remove(event["player"])
+    elif event["type"] == "mission":
+        summary["mission"] = event["mission"]
+        summary["missions"] += 1
+        summary["players"] = []  # everyone reconnects on mission change
+    elif event["type"] == "script_error":
+        summary["script_errors"] += 1
+        summary["recent_errors"] = (summary["recent_errors"] + [event["expression"]])[-LOG_RECENT_ERRORS:]
+
+def collectLogEvents(dir, profile, stats, callback=None):
+    # reads everything new in the instance's logs into stats, calling callback for each event
+    paths = {name: getPath() for name, getPath in getLogSources(dir, profile).items()}
+    available = [name for name, path in paths.items() if path is not None and os.path.isfile(path)]
+    authority = {event_type: next((name for name in names if name in available), None) for event_type, names in LOG_EVENT_SOURCES.items()}
+    for name, path in paths.items():
+        position = stats["positions"].setdefault(name, {})
+        for line in readLogLines(path, position):
+            event = parseLogLine(line)
+            if event is None or authority[event["type"]] != name:
+                continue
+
+            event["source"] = name
+            addLogEvent(stats["summary"], event)
+            if callback is not None:
+                callback(event)
+
+def printLogSummary(summary):
+    fps_avg = "%.1f" % (summary["fps_sum"] / summary["fps_samples"]) if summary["fps_samples"] > 0 else "-"
+    print("Mission:\t\t" + (summary["mission"] or "-") + " (" + str(summary["missions"]) + " loaded)")
+    print("Server FPS:\t\tlast " + str(summary["fps_last"] if summary["fps_last"] is not None else "-") + ", min " + str(summary["fps_min"] if summary["fps_min"] is not None else "-") + ", avg " + fps_avg)
+    print("Low FPS samples:\t" + str(summary["fps_low"]) + " of " + str(summary["fps_samples"]) + " below " + str(LOG_LOW_FPS))
+    print("Players online:\t\t" + str(len(summary["players"])) + (" (" + ", ".join(summary["players"]) + ")" if summary["players"] else ""))
+    print("Connects:\t\t" + str(summary["connects"]) + ", disconnects: " + str(summary["disconnects"]))
+    print("Script errors:\t\t" + str(summary["script_errors"]))
+    for error in summary["recent_errors"]:
+        print("\t" + error[:120])
+
+def openProcFiles(pid):
+    # /proc files are kept open and re-read with pread, so a sample costs three syscalls per process
+    fds = {}
+    for name in ["stat", "status", "io"]:
+        try:
+            fds[name] = os.open("/proc/" + str(pid) + "/" + name, os.O_RDONLY)
+        except OSError:
+            pass  # io needs ptrace access, the other files are enough without it
+
+    if "stat" not in fds:
+        closeProcFiles(fds)
+        return None
+
+    return fds
+
+def closeProcFiles(fds):
+    for fd in fds.values():
+        os.close(fd)
+
+def sampleProc(fds):
+    # returns a sample of the process behind fds, or None if it has exited. it can exit between any two reads
+    try:
+        stat = os.pread(fds["stat"], 4096, 0).decode()
+        status = os.pread(fds["status"], 8192, 0).decode() if "status" in fds else ""
+        io = os.pread(fds["io"], 4096, 0).decode() if "io" in fds else ""
+    except OSError:
+        return None
+
+    # the command name can contain spaces, the fields after it can't
+    fields = stat[stat.rindex(")") + 2:].split()
+    sample = {
+        "time": time.monotonic(),
+        "cpu_ticks": int(fields[11]) + int(fields[12]),
+        "threads": int(fields[17]),
+        "rss": int(fields[21]) * PROC_PAGE_SIZE,
+        "peak_rss": 0,
+        "read_bytes": 0,
+        "write_bytes": 0
+    }
+
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            sample["peak_rss"] = int(line.split()[1]) * 1024
+            break
+
+    for line in io.splitlines():
+        key, sep, value = line.partition(": ")
+        if key in ["read_bytes", "write_bytes"]:
+            sample[key] = int(value)
+
+    return sample
+
+def getCpuPercent(samples):
+    # cpu use between the last two samples, 100 is one full core
+    if len(samples) < 2:
+        return 0.0
+
+    elapsed = samples[-1]["time"] - samples[-2]["time"]
+    if elapsed <= 0:
+        return 0.0
+
+    return (samples[-1]["cpu_ticks"] - samples[-2]["cpu_ticks"]) / PROC_CLOCK_TICKS / elapsed * 100
+
+def sampleInstances(dir, sampled, history):
+    # takes one sample of every running instance of the server, sampled maps instance to its pid, fds and ring buffer
+    states = readInstanceState(dir)
+    for instance, state in states.items():
+        pid = state.get("pid") if getInstanceStatus(state) == "running" else None
+        current = sampled.get(instance)
+        if current is not None and current["pid"] != pid:
+            closeProcFiles(current["fds"])
+            current = None
+            del sampled[instance]
+
+        if current is None and pid is not None:
+            fds = openProcFiles(pid)
+            if fds is not None:
+                current = {"pid": pid, "fds": fds, "samples": collections.deque(maxlen=history)}
+                sampled[instance] = current
+
+        if current is None:
+            continue
+
+        sample = sampleProc(current["fds"])
+        if sample is None:
+            closeProcFiles(current["fds"])
+            del sampled[instance]
+            continue
+
+        current["samples"].append(sample)
+
+def printInstanceSamples(sampled):
+    print("Instance Name\t\tPID\tCPU %\tAvg CPU %\tRSS\t\tPeak RSS\tThreads\tRead\t\tWritten")
+    for instance, current in sorted(sampled.items()):
+        samples = list(current["samples"])
+        last = samples[-1]
+        cpu_avg = (last["cpu_ticks"] - samples[0]["cpu_ticks"]) / PROC_CLOCK_TICKS / (last["time"] - samples[0]["time"]) * 100 if len(samples) > 1 else 0.0
+        print("%s\t\t%d\t%.1f\t%.1f\t\t%s\t%s\t%d\t%s\t%s" % (instance, current["pid"], getCpuPercent(samples), cpu_avg, formatSize(last["rss"]), formatSize(last["peak_rss"]), last["threads"], formatSize(last["read_bytes"]), formatSize(last["write_bytes"])))
+
+def escapePrometheusLabel(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def formatPrometheusMetrics(server, sampled):
+    metrics = [
+        ("arma3_instance_cpu_percent", "gauge", "CPU use of the instance, 100 is one core", lambda samples: getCpuPercent(samples)),
+        ("arma3_instance_rss_bytes", "gauge", "Resident memory of the instance", lambda samples: samples[-1]["rss"]),
+        ("arma3_instance_peak_rss_bytes", "gauge", "Peak resident memory of the instance", lambda samples: samples[-1]["peak_rss"]),
+        ("arma3_instance_threads", "gauge", "Threads of the instance", lambda samples: samples[-1]["threads"]),
+        ("arma3_instance_read_bytes_total", "counter", "Bytes read from disk by the instance", lambda samples: samples[-1]["read_bytes"]),
+        ("arma3_instance_write_bytes_total", "counter", "Bytes written to disk by the instance", lambda samples: samples[-1]["write_bytes"])
+    ]
+
+    lines = []
+    for name, metric_type, description, getValue in metrics:
+        lines.append("# HELP " + name + " " + description)
+        lines.append("# TYPE " + name + " " + metric_type)
+        for instance, current in sorted(sampled.items()):
+            lines.append('%s{server="%s",instance="%s"} %s' % (name, escapePrometheusLabel(server), escapePrometheusLabel(instance), getValue(list(current["samples"]))))
+
+    return "\n".join(lines) + "\n"
+
+def serveMetrics(port, getMetrics):
+    # serves getMetrics() on http://127.0.0.1:port/metrics from a background thread
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+
+            body = getMetrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # keep the console for the sample table
+
+    http_server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+
+    return http_server
+
+def getResidentBytes(path, size):
+    # how much of a file is in the page cache, None if that can't be told
+    if LIBC is None or size == 0:
+        return None
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None  # deleted or replaced since the scan, e.g. by a mod update
+
+    try:
+        address = LIBC.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        if address is None or address == ctypes.c_void_p(-1).value:
+            return None
+
+        try:
+            pages = (size + PROC_PAGE_SIZE - 1) // PROC_PAGE_SIZE
+            vec = ctypes.create_string_buffer(pages)
+            if LIBC.mincore(address, size, vec) != 0:
+                return None
+
+            return min(size, (pages - vec.raw.count(0)) * PROC_PAGE_SIZE)
+        finally:
+            LIBC.munmap(address, size)
+    finally:
+        os.close(fd)
+
+def getMemAvailable():
+    with open("/proc/meminfo") as meminfo:
+        for line in meminfo:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+def prewarmMods(dir, mod_paths, budget):
+    # asks the kernel to read the mods' pbos into the page cache before the server does, in mod order and up to budget bytes.
+    # returns (total, resident, requested) bytes, resident is None if it can't be told
+    files = []
+    for mod_path in mod_paths:
+        addons = dir + "/" + mod_path + "/addons"
+        if not os.path.isdir(addons):
+            continue
+
+        with os.scandir(addons) as it:
+            files += sorted((item.path, item.stat().st_size) for item in it if item.name.endswith(".pbo") and item.is_file())
+
+    with jobExecutor(PREWARM_WORKERS) as executor:
+        resident = list(executor.map(lambda file: getResidentBytes(*file), files))
+
+    budget = min(budget, getMemAvailable())
+    wanted = []
+    requested = 0
+    for (path, size), cached in zip(files, resident):
+        missing = size - (cached or 0)
+        if missing <= 0:
+            continue
+        if requested + missing > budget:
+            continue  # a smaller file further on may still fit
+
+        wanted.append(path)
+        requested += missing
+
+    def willNeed(path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+    with jobExecutor(PREWARM_WORKERS) as executor:
+        list(executor.map(willNeed, wanted))
+
+    total = sum(size for path, size in files)
+    return total, None if None in resident else sum(resident), requested
+
+def printPrewarm(instance, result):
+    total, resident, requested = result
+    if resident is None:
+        print("Prewarming %s of %s mod data for instance %s" % (formatSize(requested), formatSize(total), instance))
+    else:
+        print("Prewarming %s of %s mod data for instance %s, %s was already cached" % (formatSize(requested), formatSize(total), instance, formatSize(resident)))
+
+def lowercase_all(dir, index=None):
+    # lowercases everything below dir, not including dir itself, and returns the entries that couldn't be renamed.
+    # index maps each directory to its inode, mtime, subfolders and collisions from the last pass, unchanged
+    # directories are not listed again
+    if index is None:
+        index = {}
+
+    collisions = []
+    seen = set()
+
+    def walk(path, rel):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+
+        seen.add(rel)
+        entry = index.get(rel)
+        if entry is not None and entry[0] == stat.st_ino and entry[1] == stat.st_mtime_ns:
+            collisions.extend(path + "/" + name for name in entry[3])
+            for sub in entry[2]:
+                walk(path + "/" + sub, rel + "/" + sub if rel else sub)
+            return
+
+        with os.scandir(path) as it:
+            entries = [(item.name, item.is_dir(follow_symlinks=False)) for item in it]
+
+        names = dict(entries)
+        subdirs = []
+        collided = []
+        for name, is_dir in entries:
+            lower = name.lower()
+            if lower != name:
+                # a file with a lowercase twin file is a fresh download next to the old copy, so it replaces it.
+                # a folder on either side can't be merged that way
+                if lower in names and (is_dir or names[lower]):
+                    collided.append(name)
+                else:
+                    try:
+                        os.replace(path + "/" + name, path + "/" + lower)
+                        del names[name]
+                        names[lower] = is_dir
+                        name = lower
+                    except OSError:
+                        collided.append(name)
+
+            if is_dir:
+                subdirs.append(name)
+
+        # renamed entries are final, so paths below stay valid going top down
+        for sub in subdirs:
+            walk(path + "/" + sub, rel + "/" + sub if rel else sub)
+
+        collisions.extend(path + "/" + name for name in collided)
+
+        stat = os.stat(path)
+        index[rel] = [stat.st_ino, stat.st_mtime_ns, subdirs, collided]
+
+    walk(dir, "")
+
+    for rel in list(index.keys()):
+        if rel not in seen:
+            del index[rel]
+
+    return collisions
+
+def lowercaseMods(dir, mod_ids, workers=1):
+    # lowercases several mods of a server in parallel, returns {mod_id: collisions}
+    index_file = dir + "/" + SERVER_LOWERCASE_INDEX
+    indexes = readJsonFile(index_file, {})
+
+    def lowercaseMod(mod_id):
+        mod_index = indexes.get(mod_id, {})
+        collisions = lowercase_all(dir + "/" + SERVER_MOD_DIR + mod_id, mod_index)
+        return mod_id, mod_index, collisions
+
+    with jobExecutor(max(1, workers)) as executor:
+        results = list(executor.map(lowercaseMod, mod_ids))
+
+    collisions = {}
+    for mod_id, mod_index, mod_collisions in results:
+        indexes[mod_id] = mod_index
+        collisions[mod_id] = mod_collisions
+
+    writeJsonFile(index_file, indexes)
+
+    return collisions
+
+def printCollisions(collisions):
+    for mod_id, paths in collisions.items():
+        for path in paths:
+            print("Could not lowercase " + path + " in mod " + mod_id)
+
+def hashFile(path):
+    # mmap lets hashlib work on the page cache directly and drop the GIL, so threads hash in parallel
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return hashlib.sha1().hexdigest()
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.sha1(data).hexdigest()
+
+def scanFiles(root, exclude=[]):
+    # {relative path: [size, mtime]} of every regular file below root, skipping exclude (relative paths) and symlinks
+    files = {}
+
+    def walk(path, rel):
+        with os.scandir(path) as it:
+            for item in it:
+                item_rel = rel + item.name
+                if item_rel in exclude:
+                    continue
+
+                if item.is_dir(follow_symlinks=False):
+                    walk(item.path, item_rel + "/")
+                elif item.is_file(follow_symlinks=False):
+                    stat = item.stat()
+                    files[item_rel] = [stat.st_size, stat.st_mtime_ns]
+
+    if os.path.isdir(root):
+        walk(root, "")
+
+    return files
+
+def hashFiles(root, paths, workers=None):
+    with jobExecutor(workers or os.cpu_count()) as executor:
+        return dict(zip(paths, executor.map(lambda path: hashFile(root + "/" + path), paths)))
+
+def recordHashManifest(root, manifest_file, exclude=[], workers=None):
+    # hashes files under root that are new or whose size or mtime changed since the manifest was written
+    manifest = readJsonFile(manifest_file, {})
+    files = scanFiles(root, exclude)
+    changed = [path for path, stat in files.items() if path not in manifest or manifest[path][:2] != stat]
+    hashes = hashFiles(root, changed, workers)
+
+    manifest = {path: stat + [hashes[path] if path in hashes else manifest[path][2]] for path, stat in files.items()}
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    writeJsonFile(manifest_file, manifest)
+
+    return manifest
+
+def verifyHashManifest(root, manifest_file, exclude=[], workers=None, full=False, quick=False):
+    # returns the files that are missing or don't match the manifest, or None if there is no manifest yet.
+    # only files whose size or mtime changed are hashed, unless full is set. quick skips hashing entirely
+    manifest = readJsonFile(manifest_file, None)
+    if manifest is None:
+        return None
+
+    files = scanFiles(root, exclude)
+    bad = [path for path in manifest if path not in files]
+    changed = [path for path in manifest if path in files and (full or files[path] != manifest[path][:2])]
+    if quick:
+        return bad + changed
+
+    hashes = hashFiles(root, changed, workers)
+    bad += [path for path in changed if hashes[path] != manifest[path][2]]
+
+    # same content with a new mtime is fine, remember it so it isn't hashed again
+    touched = [path for path in changed if hashes[path] == manifest[path][2] and files[path] != manifest[path][:2]]
+    if len(touched) > 0:
+        for path in touched:
+            manifest[path] = files[path] + [manifest[path][2]]
+        writeJsonFile(manifest_file, manifest)
+
+    return sorted(bad)
+
+def getServerHashExclude(serverconfig, exclude=SERVER_HASH_EXCLUDE):
+    # the installation's own files, not our state or instances that live inside it
+    exclude = list(exclude)
+    root = serverconfig['general']['path'].rstrip("/") + "/"
+    for instance in getInstances(serverconfig):
+        path = serverconfig[instance]['path']
+        if path.startswith(root):
+            exclude.append(path[len(root):].rstrip("/"))
+
+    return exclude
+
+def recordModHashes(dir, mod_ids, workers=None):
+    for mod_id in mod_ids:
+        path = dir + "/" + SERVER_MOD_DIR + mod_id
+        manifest_file = dir + "/" + MOD_HASH_DIR + "/" + mod_id + ".json"
+        if os.path.isdir(path):
+            recordHashManifest(path, manifest_file, workers=workers)
+        elif os.path.isfile(manifest_file):
+            os.remove(manifest_file)
+
+def parseVdf(text):
+    # minimal parser for valve's keyvalues format used by steamcmd's .acf files
+    tokens = re.findall(r'"((?:[^"\\]|\\.)*)"|([{}])', text)
+    root = {}
+    stack = [root]
+    key = None
+    for string, brace in tokens:
+        if brace == "{":
+            child = {}
+            stack[-1][key] = child
+            stack.append(child)
+            key = None
+        elif brace == "}":
+            if len(stack) > 1:
+                stack.pop()
+        elif key is None:
+            key = string
+        else:
+            stack[-1][key] = string
+            key = None
+
+    return root
+
+def formatVdf(data, indent=0):
+    text = ""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            text += "\t" * indent + '"%s"\n' % key + "\t" * indent + "{\n" + formatVdf(value, indent + 1) + "\t" * indent + "}\n"
+        else:
+            text += "\t" * indent + '"%s"\t\t"%s"\n' % (key, value)
+
+    return text
+
+def readWorkshopAcfData(dir):
+    acf_file = dir + "/" + SERVER_WORKSHOP_ACF
+    if not os.path.isfile(acf_file):
+        return {}
+
+    with open(acf_file, "r", errors="replace") as acf:
+        return parseVdf(acf.read())
+
+def readWorkshopAcf(dir):
+    return readWorkshopAcfData(dir).get("AppWorkshop", {}).get("WorkshopItemsInstalled", {})
+
+def mergeWorkshopAcf(dir, staging, mod_ids):
+    # copies what steamcmd recorded about mod_ids in a staging dir into the server's own acf, so both steamcmd and
+    # the update manifest know about mods that were downloaded elsewhere
+    staging_data = readWorkshopAcfData(staging).get("AppWorkshop", {})
+    acf_data = readWorkshopAcfData(dir)
+    workshop = acf_data.setdefault("AppWorkshop", {"appid": STEAM_ARMA3_WORKSHOP_CODE})
+    changed = False
+    for section in ["WorkshopItemsInstalled", "WorkshopItemDetails"]:
+        for mod_id in mod_ids:
+            if mod_id in staging_data.get(section, {}):
+                workshop.setdefault(section, {})[mod_id] = staging_data[section][mod_id]
+                changed = True
+
+    if changed:
+        acf_file = dir + "/" + SERVER_WORKSHOP_ACF
+        os.makedirs(os.path.dirname(acf_file), exist_ok=True)
+        with open(acf_file + ".tmp", "w") as acf:
+            acf.write(formatVdf(acf_data))
+        os.replace(acf_file + ".tmp", acf_file)
+
+def getWorkshopTimestamps(mod_ids):
+    # asks the workshop when each item was last updated, returns None if it can't be reached
+    try:
+        return getWorkshopSource().getTimestamps(mod_ids)
+    except (OSError, ValueError, KeyError):
+        return None
+
+class SteamWorkshopSource:
+    # workshop metadata from the steam web api. for a mod, the collection details list what it requires
+
+    def post(self, url, count_field, ids):
+        fields = {count_field: len(ids)}
+        for i, item_id in enumerate(ids):
+            fields["publishedfileids[" + str(i) + "]"] = item_id
+
+        request = urllib.request.Request(url, data=urlparse.urlencode(fields).encode())
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.load(response)["response"]
+
+    def getItems(self, ids):
+        # {id: {"title": str, "collection": bool, "children": [ids]}}, children are a collection's items or a mod's dependencies
+        items = {}
+        for item in self.post(STEAM_API_FILE_DETAILS, "itemcount", ids)["publishedfiledetails"]:
+            if item.get("result") == 1:
+                # collections are made with the workshop app itself rather than the game's
+                collection = str(item.get("creator_app_id")) == STEAM_WORKSHOP_APP_CODE
+                if not collection and int(item.get("file_size") or 0) == 0:
+                    print("Workshop item " + item["publishedfileid"] + " (" + item.get("title", "") + ") has no content")
+                items[item["publishedfileid"]] = {"title": item.get("title", ""), "collection": collection, "children": []}
+
+        for collection in self.post(STEAM_API_COLLECTION_DETAILS, "collectioncount", ids).get("collectiondetails", []):
+            if collection["publishedfileid"] in items:
+                children = sorted(collection.get("children", []), key=lambda child: child.get("sortorder", 0))
+                items[collection["publishedfileid"]]["children"] = [child["publishedfileid"] for child in children]
+
+        return items
+
+    def getTimestamps(self, ids):
+        timestamps = {}
+        for item in self.post(STEAM_API_FILE_DETAILS, "itemcount", ids)["publishedfiledetails"]:
+            if "time_updated" in item:
+                timestamps[item["publishedfileid"]] = int(item["time_updated"])
+
+        return timestamps
+
+class FixtureWorkshopSource:
+    # workshop metadata from a JSON file of {id: item} shaped like SteamWorkshopSource's items, plus an optional
+    # "updated" timestamp, for testing without steam
+
+    def __init__(self, file):
+        self.items = readJsonFile(file, {})
+
+    def getItems(self, ids):
+        return {item_id: self.items[item_id] for item_id in ids if item_id in self.items}
+
+    def getTimestamps(self, ids):
+        return {item_id: self.items[item_id]["updated"] for item_id in ids if "updated" in self.items.get(item_id, {})}
+
+def getWorkshopSource():
+    return FixtureWorkshopSource(WORKSHOP_FIXTURE) if WORKSHOP_FIXTURE else SteamWorkshopSource()
+
+def getWorkshopItems(ids, source, cache):
+    # metadata for ids, from the cache where it's fresh enough. returns None if the source can't be reached
+    now = time.time()
+    missing = [item_id for item_id in ids if now - cache.get(item_id, {}).get("fetched", 0) > WORKSHOP_CACHE_TTL]
+    if len(missing) > 0:
+        try:
+            fetched = source.getItems(missing)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        for item_id, item in fetched.items():
+            item["fetched"] = now
+            cache[item_id] = item
+
+    return {item_id: cache[item_id] for item_id in ids if item_id in cache}
+
+def resolveWorkshopItems(ids, source, cache):
+    # expands collections into their items and adds every mod's dependencies, all the way down.
+    # returns the mods in the order they were found, or None if the source can't be reached
+    mods = []
+    seen = set()
+    pending = list(ids)
+    while len(pending) > 0:
+        batch = [item_id for item_id in dict.fromkeys(pending) if item_id not in seen]
+        seen.update(batch)
+        pending = []
+
+        items = getWorkshopItems(batch, source, cache)
+        if items is None:
+            return None
+
+        for item_id in batch:
+            item = items.get(item_id)
+            if item is None or not item["collection"]:
+                mods.append(item_id)  # unknown items are taken as plain mods
+            if item is not None:
+                pending += item["children"]
+
+    return mods
+
+def sortModsByDependencies(mod_ids, cache):
+    # orders mods so each loads after the mods it depends on, otherwise keeping the given order. cycles are broken in that order
+    enabled = set(mod_ids)
+    ordered = []
+    visiting = set()
+
+    def place(mod_id):
+        if mod_id in visiting or mod_id in ordered:
+            return
+
+        visiting.add(mod_id)
+        for dependency in cache.get(mod_id, {}).get("children", []):
+            if dependency in enabled:
+                place(dependency)
+        visiting.discard(mod_id)
+        ordered.append(mod_id)
+
+    for mod_id in mod_ids:
+        place(mod_id)
+
+    return ordered
+
+def readModManifest(dir):
+    # a corrupt manifest reads as empty, so everything is treated as stale
+    return readJsonFile(dir + "/" + SERVER_MOD_MANIFEST, {})
+
+def writeModManifest(dir, manifest):
+    writeJsonFile(dir + "/" + SERVER_MOD_MANIFEST, manifest, indent=1, sort_keys=True)
+
+def recordModManifest(dir, mod_ids, timestamps=None):
+    # remembers the installed state of mod_ids so the next update can skip them
+    manifest = readModManifest(dir)
+    acf_items = readWorkshopAcf(dir)
+    for mod_id in mod_ids:
+        path = dir + "/" + SERVER_MOD_DIR + mod_id
+        if not os.path.isdir(path):
+            manifest.pop(mod_id, None)
+            continue
+
+        acf_item = acf_items.get(mod_id, {})
+        timeupdated = int(acf_item.get("timeupdated", 0))
+        if timestamps is not None and mod_id in timestamps:
+            timeupdated = max(timeupdated, timestamps[mod_id])
+
+        stamp = getTreeStamp(path)
+        manifest[mod_id] = {
+            "timeupdated": timeupdated,
+            "manifest": acf_item.get("manifest", ""),
+            "size": stamp[1],
+            "stamp": stamp
+        }
+
+    writeModManifest(dir, manifest)
+
+def getStaleMods(dir, mod_ids, timestamps):
+    # returns the mods that are missing, changed on disk, or older than the workshop copy
+    manifest = readModManifest(dir)
+    stale = []
+    for mod_id in mod_ids:
+        path = dir + "/" + SERVER_MOD_DIR + mod_id
+        entry = manifest.get(mod_id)
+        if entry is None or not os.path.isdir(path):
+            stale.append(mod_id)
+        elif getTreeStamp(path) != entry.get("stamp"):
+            stale.append(mod_id)
+        elif timestamps is None or timestamps.get(mod_id, 0) > entry["timeupdated"]:
+            stale.append(mod_id)
+
+    return stale
+
+@contextlib.contextmanager
+def lockStore(store):
+    # held while downloading into or changing the shared mod store
+    os.makedirs(store, exist_ok=True)
+    with open(store + "/" + STORE_LOCK, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def linkStoreMods(store, dir, mod_ids, live=None):
+    # points the server's copies of mod_ids at the shared store, moving real copies into the store if it lacks them.
+    # links go into live, the server's live files unless given
+    refs = readJsonFile(store + "/" + STORE_REFS, {})
+    live = live or getLiveDir(dir)
+    os.makedirs(live + "/" + SERVER_MOD_DIR, exist_ok=True)
+    os.makedirs(store + "/" + SERVER_MOD_DIR, exist_ok=True)
+    for mod_id in mod_ids:
+        if mod_id == "":
+            continue
+
+        store_path = store + "/" + SERVER_MOD_DIR + mod_id
+        server_path = live + "/" + SERVER_MOD_DIR + mod_id
+
+        if os.path.isdir(server_path) and not os.path.islink(server_path):
+            if os.path.isdir(store_path):
+                shutil.rmtree(server_path)
+            else:
+                shutil.move(server_path, store_path)
+
+        if not os.path.isdir(store_path):
+            continue
+
+        if os.path.islink(server_path) and os.readlink(server_path) != store_path:
+            os.unlink(server_path)
+        if not os.path.islink(server_path):
+            os.symlink(store_path, server_path)
+
+        if dir not in refs.setdefault(mod_id, []):
+            refs[mod_id].append(dir)
+
+    writeJsonFile(store + "/" + STORE_REFS, refs, indent=1)
+
+def unlinkStoreMods(store, dir, mod_ids):
+    # drops the server's links to mod_ids, the store copy is deleted once no server uses it.
+    # returns the mods the server was using from the store and, of those, the ones deleted from it
+    refs = readJsonFile(store + "/" + STORE_REFS, {})
+    released = []
+    deleted = []
+    for mod_id in mod_ids:
+        if mod_id == "":
+            continue
+
+        server_path = getLiveDir(dir) + "/" + SERVER_MOD_DIR + mod_id
+        linked = os.path.islink(server_path)
+        if linked:
+            os.unlink(server_path)
+        elif dir not in refs.get(mod_id, []):
+            continue  # not this server's, whoever else uses it
+
+        released.append(mod_id)
+        users = [user for user in refs.get(mod_id, []) if user != dir]
+        if len(users) > 0:
+            refs[mod_id] = users
+            continue
+
+        refs.pop(mod_id, None)
+        store_path = store + "/" + SERVER_MOD_DIR + mod_id
+        if os.path.isdir(store_path):
+            shutil.rmtree(store_path)
+            deleted.append(mod_id)
+
+    writeJsonFile(store + "/" + STORE_REFS, refs, indent=1)
+    recordModManifest(store, deleted)
+    recordModHashes(store, deleted)
+
+    return released, deleted
+
+def openStateDb(file=STATE_DB):
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    db = sqlite3.connect(file, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA foreign_keys=ON")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS servers (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, path TEXT UNIQUE NOT NULL);
+        CREATE TABLE IF NOT EXISTS mods (server_id INTEGER NOT NULL REFERENCES servers(id) ON DELETE CASCADE, mod_id TEXT NOT NULL, position INTEGER NOT NULL, PRIMARY KEY (server_id, mod_id));
+        CREATE TABLE IF NOT EXISTS instances (id INTEGER PRIMARY KEY, server_id INTEGER NOT NULL REFERENCES servers(id) ON DELETE CASCADE, name TEXT NOT NULL, UNIQUE (server_id, name));
+        CREATE TABLE IF NOT EXISTS instance_params (instance_id INTEGER NOT NULL REFERENCES instances(id) ON DELETE CASCADE, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (instance_id, key));
+        CREATE TABLE IF NOT EXISTS instance_mods (instance_id INTEGER NOT NULL REFERENCES instances(id) ON DELETE CASCADE, mod_id TEXT NOT NULL, position INTEGER NOT NULL, PRIMARY KEY (instance_id, mod_id));
+        CREATE INDEX IF NOT EXISTS instance_mods_by_mod ON instance_mods (mod_id);
+    """)
+    return db
+
+@contextlib.contextmanager
+def stateTransaction(db):
+    # takes the write lock up front so concurrent invocations queue up instead of failing halfway
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    else:
+        db.execute("COMMIT")
+
+def getServerPathFromName(name, db, available=True):
+    # None if there's no such server. with available, also if its directory is missing, e.g. on a disk that isn't
+    # mounted. its state is kept either way, only the delete command removes it
+    row = db.execute("SELECT path FROM servers WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+
+    if available and not os.path.isdir(row[0]):
+        print("Server " + name + " is unavailable, " + row[0] + " is missing")
+        return None
+
+    return row[0]
+
+def splitMods(mods):
+    return [mod for mod in mods.split(",") if mod != ""]
+
+def configToDict(serverconfig):
+    return {section: dict(serverconfig[section]) for section in serverconfig.sections()}
+
+def loadServerConfig(db, name):
+    # builds the same ConfigParser layout config.ini used to have
+    serverconfig = configparser.ConfigParser()
+    server_id, path = db.execute("SELECT id, path FROM servers WHERE name = ?", (name,)).fetchone()
+
+    serverconfig['general'] = {"name": name, "path": path}
+    mods = db.execute("SELECT mod_id FROM mods WHERE server_id = ? ORDER BY position", (server_id,)).fetchall()
+    serverconfig['server'] = {"mods": ",".join(mod for (mod,) in mods)}
+
+    for instance_id, instance in db.execute("SELECT id, name FROM instances WHERE server_id = ? ORDER BY id", (server_id,)).fetchall():
+        serverconfig[instance] = dict(db.execute("SELECT key, value FROM instance_params WHERE instance_id = ?", (instance_id,)).fetchall())
+        mods = db.execute("SELECT mod_id FROM instance_mods WHERE instance_id = ? ORDER BY position", (instance_id,)).fetchall()
+        serverconfig[instance]['mods'] = ",".join(mod for (mod,) in mods)
+
+    return serverconfig
+
+def saveModList(db, table, owner_column, owner_id, before, after):
+    # applies only the mods that were added or removed, so concurrent changes to other mods survive
+    for mod_id in set(before) - set(after):
+        db.execute("DELETE FROM " + table + " WHERE " + owner_column + " = ? AND mod_id = ?", (owner_id, mod_id))
+
+    for mod_id in after:
+        if mod_id not in before:
+            db.execute("INSERT OR IGNORE INTO " + table + " (" + owner_column + ", mod_id, position) SELECT ?, ?, COALESCE(MAX(position), -1) + 1 FROM " + table + " WHERE " + owner_column + " = ?", (owner_id, mod_id, owner_id))
+
+def saveServerConfig(db, before, serverconfig):
+    # writes the changes between the before snapshot and serverconfig in one transaction, returns the new snapshot
+    after = configToDict(serverconfig)
+    name = after['general']['name']
+
+    with stateTransaction(db):
+        db.execute("INSERT OR IGNORE INTO servers (name, path) VALUES (?, ?)", (name, after['general']['path']))
+        server_id = db.execute("SELECT id FROM servers WHERE name = ?", (name,)).fetchone()[0]
+        saveModList(db, "mods", "server_id", server_id, splitMods(before.get('server', {}).get('mods', "")), splitMods(after['server']['mods']))
+
+        instances_before = [section for section in before if section != "general" and section != "server"]
+        instances_after = [section for section in after if section != "general" and section != "server"]
+        for instance in set(instances_before) - set(instances_after):
+            db.execute("DELETE FROM instances WHERE server_id = ? AND name = ?", (server_id, instance))
+
+        for instance in instances_after:
+            params_before = dict(before.get(instance, {}))
+            params_after = dict(after[instance])
+            mods_before = splitMods(params_before.pop('mods', ""))
+            mods_after = splitMods(params_after.pop('mods', ""))
+
+            db.execute("INSERT OR IGNORE INTO instances (server_id, name) VALUES (?, ?)", (server_id, instance))
+            instance_id = db.execute("SELECT id FROM instances WHERE server_id = ? AND name = ?", (server_id, instance)).fetchone()[0]
+
+            for key, value in params_after.items():
+                if params_before.get(key) != value:
+                    db.execute("INSERT OR REPLACE INTO instance_params (instance_id, key, value) VALUES (?, ?, ?)", (instance_id, key, value))
+            for key in set(params_before) - set(params_after):
+                db.execute("DELETE FROM instance_params WHERE instance_id = ? AND key = ?", (instance_id, key))
+
+            saveModList(db, "instance_mods", "instance_id", instance_id, mods_before, mods_after)
+
+    return after
+
+def importServerConfig(db, dir):
+    # imports a server's old config.ini, returns False if it doesn't have one
+    conffile = dir + "/" + CONFIG_FILE_SERVER
+    if not os.path.isfile(conffile):
+        return False
+
+    serverconfig = configparser.ConfigParser()
+    serverconfig.read(conffile)
+    if db.execute("SELECT 1 FROM servers WHERE name = ? OR path = ?", (serverconfig['general']['name'], serverconfig['general']['path'])).fetchone() is None:
+        saveServerConfig(db, {}, serverconfig)
+
+    return True
+
+def getInstancesUsingMod(db, mod_id, server=None):
+    # (server, instance) pairs that have mod_id enabled, answered from the instance_mods index
+    query = "SELECT servers.name, instances.name FROM instance_mods JOIN instances ON instances.id = instance_mods.instance_id JOIN servers ON servers.id = instances.server_id WHERE instance_mods.mod_id = ?"
+    params = [mod_id]
+    if server is not None:
+        query += " AND servers.name = ?"
+        params.append(server)
+
+    return db.execute(query + " ORDER BY servers.name, instances.name", params).fetchall()
+
+def parseModMeta(dir):
+    # reads name, publishedid and timestamp from mod.cpp and meta.cpp, mod.cpp wins for the name
+    meta_data = {"name": "", "publishedid": "", "timestamp": 0}
     files = [dir + "/mod.cpp", dir + "/meta.cpp"]  # check both files
 
     for file in files:
         if not os.path.isfile(file):
             continue
 
-        with open(file, "r") as meta:
+        with open(file, "r", errors="replace") as meta:
             for line in meta:
-                if line.startswith("name"):
-                    name = line.partition("\"")[2]
-                    name = name.partition("\"")[0]
-                    return name
+                key, sep, value = line.strip().partition("=")
+                key = key.strip()
+                if sep == "" or key not in meta_data:
+                    continue
+
+                if key == "name":
+                    if meta_data["name"] == "":
+                        meta_data["name"] = value.partition("\"")[2].partition("\"")[0]
+                elif key == "publishedid":
+                    meta_data["publishedid"] = value.strip(" ;")
+                elif key == "timestamp":
+                    # meta.cpp timestamps are .NET DateTime binaries, the top two bits are the kind
+                    try:
+                        ticks = int(value.strip(" ;")) & 0x3FFFFFFFFFFFFFFF
+                    except ValueError:
+                        continue
+                    meta_data["timestamp"] = max(0, (ticks - 621355968000000000) // 10000000)
+
+    return meta_data
+
+def getModName(dir):
+    return parseModMeta(dir)["name"]
+
+def getDirSize(dir):
+    size = 0
+    with os.scandir(dir) as it:
+        for item in it:
+            if item.is_dir(follow_symlinks=False):
+                size += getDirSize(item.path)
+            elif item.is_file(follow_symlinks=False):
+                size += item.stat(follow_symlinks=False).st_size
+
+    return size
+
+def getTreeStamp(dir):
+    # number of files, their total size and the newest file mtime below dir. any file written since, in place or
+    # replaced, changes it
+    stamp = [0, 0, 0]
+    with os.scandir(dir) as it:
+        for item in it:
+            if item.is_dir(follow_symlinks=False):
+                sub_stamp = getTreeStamp(item.path)
+                stamp = [stamp[0] + sub_stamp[0], stamp[1] + sub_stamp[1], max(stamp[2], sub_stamp[2])]
+            elif item.is_file(follow_symlinks=False):
+                item_stat = item.stat(follow_symlinks=False)
+                stamp = [stamp[0] + 1, stamp[1] + item_stat.st_size, max(stamp[2], item_stat.st_mtime_ns)]
+
+    return stamp
+
+def getModStamp(dir):
+    # mtimes of the mod dir and its metadata files, the cache key for a mod
+    stamp = []
+    for file in [dir, dir + "/mod.cpp", dir + "/meta.cpp"]:
+        try:
+            stamp.append(os.stat(file).st_mtime_ns)
+        except OSError:
+            stamp.append(0)
+
+    return stamp
+
+def readModCache(dir):
+    return readJsonFile(dir + "/" + SERVER_MOD_CACHE, {})
+
+def writeModCache(dir, cache):
+    writeJsonFile(dir + "/" + SERVER_MOD_CACHE, cache)
+
+def getModInfo(dir, mod_id, cache):
+    # returns cached metadata for a mod, refreshing it only if the mod changed on disk.
+    # returns True as second value if the cache was updated
+    path = dir + "/" + SERVER_MOD_DIR + mod_id
+    stamp = getModStamp(path)
+    entry = cache.get(mod_id)
+    if entry is not None and entry["stamp"] == stamp:
+        return entry, False
+
+    entry = parseModMeta(path)
+    entry["size"] = getDirSize(path) if os.path.isdir(path) else 0
+    entry["stamp"] = stamp
+    cache[mod_id] = entry
+
+    return entry, True
+
+def formatSize(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            break
+        size /= 1024
+
+    return "%.1f %s" % (size, unit) if unit != "B" else "%d B" % size
+
+def printModList(dir, mod_ids):
+    cache = readModCache(dir)
+    changed = False
+
+    print("Workshop ID\t\tSize\t\tLast Updated\t\tMod Name")
+    for mod_id in mod_ids:
+        if mod_id == "":
+            continue
 
-    return ""
+        info, updated = getModInfo(dir, mod_id, cache)
+        changed = changed or updated
+        last_updated = time.strftime("%Y-%m-%d %H:%M", time.localtime(info["timestamp"])) if info["timestamp"] else "unknown\t"
+        print(mod_id + "\t\t" + formatSize(info["size"]) + "\t\t" + last_updated + "\t" + info["name"])
+
+    if changed:
+        writeModCache(dir, cache)
+
+def writeMainConfig(config):
+    # check to make sure dir exists
+    os.makedirs(CONFIG_FILE_MAIN_DIR, exist_ok=True)
+
+    with open(CONFIG_FILE_MAIN, 'w') as config_file:
+        config.write(config_file)
+
+class JobOutput:
+    # stands in for stdout and stderr in the daemon, handing what each thread prints to its job
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        job = getJob()
+        if job is None:
+            return self.stream.write(text)
+
+        job.emit({"output": text})
+        return len(text)
+
+    def flush(self):
+        if getJob() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class DaemonJob:
+    # one queued command. everything it prints is kept as events, so clients can follow it from the start
+
+    def __init__(self, daemon, job_id, server, argv, interactive, cwd=None):
+        self.daemon = daemon
+        self.id = job_id
+        self.server = server
+        self.argv = argv
+        self.interactive = interactive  # whether a client is there to answer prompts
+        self.cwd = cwd  # the submitting client's
+        self.status = "queued"
+        self.exit_code = None
+        self.events = []
+        self.cleanup = []
+        self.answers = queue.Queue()
+        self.condition = threading.Condition()
+
+    def emit(self, event):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def ask(self, text, secret):
+        if not self.interactive:
+            raise EOFError("nobody to answer: " + text)
+
+        self.emit({"prompt": text, "secret": secret})
+        answer = self.answers.get()
+        if answer is None:
+            raise EOFError("client went away before answering: " + text)
+
+        return answer
+
+    def detach(self):
+        # the submitting client is gone, prompts can't be answered any more
+        self.interactive = False
+        self.answers.put(None)
+
+    def run(self):
+        setJob(self)
+        self.status = "running"
+        try:
+            main(self.argv)
+            code = 0
+        except SystemExit as e:
+            if isinstance(e.code, str):
+                print(e.code)
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except EOFError as e:
+            print("Aborted, " + str(e))
+            code = 1
+        except Exception:
+            print(traceback.format_exc())
+            code = 1
+        finally:
+            for callback in self.cleanup:
+                try:
+                    callback()
+                except Exception:
+                    print(traceback.format_exc())
+            setJob(None)
+
+        self.exit_code = code
+        self.status = "done" if code == 0 else "failed"
+        self.emit({"exit": code})
+
+    def follow(self):
+        # yields the job's events from the start, waiting for new ones until it exits
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.events):
+                    self.condition.wait()
+                events = self.events[index:]
+
+            index += len(events)
+            for event in events:
+                yield event
+                if "exit" in event:
+                    return
+
+class Daemon:
+    # runs queued jobs one at a time per installation and installations in parallel, keeping steamcmd sessions warm between jobs
+
+    def __init__(self):
+        self.jobs = collections.OrderedDict()
+        self.queues = {}
+        self.pools = {}
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def submit(self, argv, server, interactive=True, cwd=None):
+        with self.lock:
+            job = DaemonJob(self, str(self.next_id), server, argv, interactive, cwd)
+            self.next_id += 1
+            self.jobs[job.id] = job
+
+            finished = [old for old in self.jobs.values() if old.exit_code is not None]
+            for old in finished[:max(0, len(finished) - DAEMON_JOB_HISTORY)]:
+                del self.jobs[old.id]
+
+            if server not in self.queues:
+                self.queues[server] = queue.Queue()
+                threading.Thread(target=self.work, args=(self.queues[server],), daemon=True).start()
+            self.queues[server].put(job)
+
+        return job
+
+    def work(self, jobs):
+        while True:
+            jobs.get().run()
+
+    def getPool(self, server, username, password, size):
+        # one pool per installation, so installations don't wait on each other's sessions
+        with self.lock:
+            pool = self.pools.get((server, username, password))
+            if pool is None:
+                pool = SteamSessionPool(username, password, size)
+                self.pools[(server, username, password)] = pool
+            pool.size = max(pool.size, size)
+
+        return pool
+
+    def listJobs(self):
+        with self.lock:
+            return [{"id": job.id, "server": job.server, "argv": job.argv, "status": job.status, "exit": job.exit_code} for job in self.jobs.values()]
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    # one JSON request per connection, answered with JSON lines
+
+    def send(self, event):
+        self.wfile.write((json.dumps(event) + "\n").encode())
+        self.wfile.flush()
+
+    def followJob(self, job, interactive):
+        for event in job.follow():
+            if "prompt" in event and not interactive:
+                continue
+
+            self.send(event)
+            if "prompt" in event:
+                line = self.rfile.readline()
+                if not line:
+                    raise ConnectionError("client closed the connection")
+                job.answers.put(json.loads(line)["answer"])
+
+    def handle(self):
+        daemon = self.server.daemon
+        line = self.rfile.readline()
+        if not line:
+            return  # someone checking whether a daemon is running
+        request = json.loads(line)
+
+        if "argv" in request:
+            job = daemon.submit(request["argv"], request["server"], not request.get("detach", False), request.get("cwd"))
+            self.send({"job": job.id})
+            if not request.get("detach", False):
+                try:
+                    self.followJob(job, True)
+                except (OSError, ValueError):
+                    job.detach()
+        elif "follow" in request:
+            job = daemon.jobs.get(request["follow"])
+            if job is None:
+                self.send({"error": "Job not found"})
+            else:
+                self.followJob(job, False)
+        elif "jobs" in request:
+            self.send({"jobs": daemon.listJobs()})
+
+def serveDaemon(path):
+    # a socket left behind by a daemon that died is replaced, one that answers means a daemon is already running
+    if os.path.exists(path):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(path)
+            print("A daemon is already running on " + path)
+            exit(1)
+        except ConnectionRefusedError:
+            os.unlink(path)
+
+    old_umask = os.umask(0o077)  # credentials go through the socket
+    server = socketserver.ThreadingUnixStreamServer(path, DaemonRequestHandler)
+    os.umask(old_umask)
+    server.daemon_threads = True
+    server.daemon = Daemon()
+
+    sys.stdout = JobOutput(sys.stdout)
+    sys.stderr = JobOutput(sys.stderr)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print("Listening on " + path, flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+def runDaemonClient(request):
+    # sends a request to the daemon and plays back what comes back, answering prompts here.
+    # returns the exit code, or None if no daemon is running
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(DAEMON_SOCKET)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        return None
+
+    with client, client.makefile("rw") as stream:
+        stream.write(json.dumps(request) + "\n")
+        stream.flush()
+
+        for line in stream:
+            event = json.loads(line)
+            if "output" in event:
+                sys.stdout.write(event["output"])
+                sys.stdout.flush()
+            elif "prompt" in event:
+                answer = getpass(event["prompt"]) if event["secret"] else input(event["prompt"])
+                stream.write(json.dumps({"answer": answer}) + "\n")
+                stream.flush()
+            elif "job" in event and request.get("detach", False):
+                print("Queued as job " + event["job"])
+                return 0
+            elif "jobs" in event:
+                print("Job\tServer\t\tStatus\t\tCommand")
+                for job in event["jobs"]:
+                    print("%s\t%s\t\t%s\t\t%s" % (job["id"], job["server"], job["status"], " ".join(job["argv"])))
+                return 0
+            elif "error" in event:
+                print(event["error"])
+                return 1
+            elif "exit" in event:
+                return event["exit"]
+
+    print("Lost the connection to the daemon")
+    return 1
+
+def isDaemonJob(args):
+    # commands that download or change installations, queued by the daemon when it's running
+    if args.subcommand in ["create", "update", "delete"]:
+        return True
+    if args.subcommand == "mods":
+        return args.subtask in ["add", "delete"]
+    if args.subcommand == "verify":
+        return args.fix
+
+    return False
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
 
-def main():
     # load existing config
     config = configparser.ConfigParser()
     config.read(CONFIG_FILE_MAIN)
@@ -121,14 +2584,40 @@ def main():
         if 'password' in config['steam']:
             STEAM_PASSWORD = config['steam']['password']
 
+        if 'workers' in config['steam']:
+            STEAM_WORKERS = int(config['steam']['workers'])
+
+    MOD_STORE = None
+    if 'store' in config:
+        if 'path' in config['store']:
+            # links into the store have to work from any cwd
+            MOD_STORE = os.path.abspath(os.path.expanduser(config['store']['path']))
+
+    STATE = openStateDb()
+
+    # servers used to be tracked in the main config with a config.ini each, move them into the state db
     if 'state' in config:
-        if 'serverlist' in config['state']:
-            SERVER_LIST = config['state']['serverlist'].split(",")
+        # servers that can't be read right now, e.g. on a disk that isn't mounted, stay listed to be imported later
+        SERVER_LIST = [server for server in config['state'].get('serverlist', "").split(",") if server != ""]
+        MISSING_SERVERS = [server for server in SERVER_LIST if not importServerConfig(STATE, server)]
+        CONFIG_CHANGED = MISSING_SERVERS != SERVER_LIST or len(MISSING_SERVERS) == 0 or 'index' in config
+        if len(MISSING_SERVERS) > 0:
+            config['state']['serverlist'] = ",".join(MISSING_SERVERS)
+        else:
+            config.remove_section('state')
+
+        config.remove_section('index')
+        if CONFIG_CHANGED:
+            writeMainConfig(config)
 
     # Handle cli arguments
     parser = argparse.ArgumentParser()
     # -s parameter
     parser.add_argument("-s", "--save", help="Save steam login info to config file", action="store_true")
+    # -j parameter
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parallel steamcmd workers for mod downloads")
+    parser.add_argument("--no-daemon", help="Run here even if a daemon is running", action="store_true")
+    parser.add_argument("--detach", help="Only queue the job with the daemon, don't wait for it", action="store_true")
 
     subparsers = parser.add_subparsers(dest="subcommand")
 
@@ -145,6 +2634,17 @@ def main():
     parser_update.add_argument("name", nargs=1, help="Name of server to be updated")
     parser_update.add_argument("--mods-only", help="Only update mods", action="store_true")
     parser_update.add_argument("--server-only", help="Only update server", action="store_true")
+    parser_update.add_argument("--force", help="Re-download all mods, even ones that are up to date", action="store_true")
+    parser_update.add_argument("--staged", help="Update a copy of the server, then switch running instances over one at a time", action="store_true")
+    parser_update.add_argument("--rollback", help="Switch back to the version before the last staged update", action="store_true")
+
+    # Verify
+    parser_verify = subparsers.add_parser("verify", help="check server and mod files against their hash manifests")
+    parser_verify.add_argument("name", nargs=1, help="Name of server to be verified")
+    parser_verify.add_argument("--mods-only", help="Only verify mods", action="store_true")
+    parser_verify.add_argument("--server-only", help="Only verify server", action="store_true")
+    parser_verify.add_argument("--full", help="Hash every file, not just the ones whose size or mtime changed", action="store_true")
+    parser_verify.add_argument("--fix", help="Re-download whatever is corrupt", action="store_true")
 
     # Mods
     parser_mods = subparsers.add_parser("mods", help="Manage mods for existing arma 3 server")
@@ -153,7 +2653,7 @@ def main():
     
     # Mods > Add
     parser_mods_add = subparsers_mods.add_parser("add", help="Add a new mod from the steam workshop")
-    parser_mods_add.add_argument("mod", nargs="+", help="URL(s) of mod on steam workshop, or workshop ID")
+    parser_mods_add.add_argument("mod", nargs="+", help="URL(s) or workshop ID(s) of mods or collections on the steam workshop")
     
     # Mods > Delete *
     parser_mods_delete = subparsers_mods.add_parser("delete", help="Delete a mod")
@@ -162,6 +2662,10 @@ def main():
     # Mods > List
     parser_mods_list = subparsers_mods.add_parser("list", help="List all mods")
 
+    # Mods > Instances
+    parser_mods_instances = subparsers_mods.add_parser("instances", help="List the instances of all servers that have a mod enabled")
+    parser_mods_instances.add_argument("mod", nargs=1, help="Workshop ID")
+
     # Instance
     parser_instance = subparsers.add_parser("instance", help="edit instances within server")
     parser_instance.add_argument("name", nargs=1, help="Name of server to be modified")
@@ -200,46 +2704,135 @@ def main():
     parser_instance_start = subparsers_instance.add_parser("start", help="Start an instance")
     parser_instance_start.add_argument("i_name", nargs=1, help="Name of instance")
     
+    # Instance > Supervise
+    parser_instance_supervise = subparsers_instance.add_parser("supervise", help="Run instances in the background and restart them if they crash")
+    parser_instance_supervise.add_argument("i_name", nargs="*", help="Name of instance(s), all instances if none are given")
+
+    # Instance > Stop
+    parser_instance_stop = subparsers_instance.add_parser("stop", help="Stop a running instance")
+    parser_instance_stop.add_argument("i_name", nargs=1, help="Name of instance")
+
+    # Instance > Stats
+    parser_instance_stats = subparsers_instance.add_parser("stats", help="Show performance and player stats from the instance logs")
+    parser_instance_stats.add_argument("i_name", nargs=1, help="Name of instance")
+    parser_instance_stats.add_argument("--follow", help="Keep following the logs and print events as they happen", action="store_true")
+    parser_instance_stats.add_argument("--reset", help="Forget previous stats and read the logs from the start", action="store_true")
+
+    # Instance > Monitor
+    parser_instance_monitor = subparsers_instance.add_parser("monitor", help="Show CPU, memory and disk use of running instances")
+    parser_instance_monitor.add_argument("--interval", type=float, default=5, help="Seconds between samples")
+    parser_instance_monitor.add_argument("--samples", type=int, default=120, help="Number of samples kept per instance")
+    parser_instance_monitor.add_argument("--http", type=int, metavar="PORT", help="Serve prometheus metrics on 127.0.0.1:PORT/metrics")
+    parser_instance_monitor.add_argument("--quiet", help="Don't print the sample table, only serve metrics", action="store_true")
+
     # Instance > List
     parser_instance_list = subparsers_instance.add_parser("list", help="list instances")
 
-    args = parser.parse_args()
+    # Daemon
+    parser_daemon = subparsers.add_parser("daemon", help="Queue downloads and changes to installations in a background daemon")
+    subparsers_daemon = parser_daemon.add_subparsers(dest="subtask")
+
+    # Daemon > Run
+    parser_daemon_run = subparsers_daemon.add_parser("run", help="Run the daemon, listening on " + DAEMON_SOCKET)
+
+    # Daemon > Jobs
+    parser_daemon_jobs = subparsers_daemon.add_parser("jobs", help="List queued, running and recent jobs")
+
+    # Daemon > Follow
+    parser_daemon_follow = subparsers_daemon.add_parser("follow", help="Show the output of a job, following it until it's done")
+    parser_daemon_follow.add_argument("job", nargs=1, help="Job ID")
+
+    args = parser.parse_args(argv)
     #print(args)  # DEBUG
 
+    # with a daemon running, this only hands the command over and shows its progress
+    if getJob() is None and not args.no_daemon and isDaemonJob(args):
+        code = runDaemonClient({"argv": argv, "server": args.name[0], "detach": args.detach, "cwd": os.getcwd()})
+        if code is not None:
+            exit(code)
+        if args.detach:
+            print("No daemon is running")
+            exit(1)
+
+    if args.subcommand == 'daemon':
+        if args.subtask == 'run':
+            serveDaemon(DAEMON_SOCKET)
+            exit(0)
+
+        if args.subtask == 'jobs':
+            code = runDaemonClient({"jobs": True})
+        elif args.subtask == 'follow':
+            code = runDaemonClient({"follow": args.job[0]})
+        else:
+            parser_daemon.print_help()
+            exit(1)
+
+        if code is None:
+            print("No daemon is running")
+            exit(1)
+        exit(code)
+
     # Check if steamcmd is available on the system
     steamcmd_exists = which(BINARY_STEAMCMD) is not None
     if not steamcmd_exists:
         print("SteamCMD is not available on this system or is not available in the path.")
         exit(1)
 
+    if args.jobs is not None:
+        STEAM_WORKERS = args.jobs
+    elif 'STEAM_WORKERS' not in locals():
+        STEAM_WORKERS = 1
+
     if args.subcommand is not None:
         serverconfig = configparser.ConfigParser()
         SERVER_NAME = args.name[0]
-        if 'SERVER_LIST' in locals():
-            SERVER_DIR = getServerPathFromName(SERVER_NAME, SERVER_LIST)  # will return none if nonexistant
-            if SERVER_DIR is None and args.subcommand != 'create':
-                print("Server not found!")
-                exit(1)
-
-            if SERVER_DIR is not None:
-                SERVER_CONF_LOCATION = SERVER_DIR + "/config.ini"
-
-                if os.path.isfile(SERVER_CONF_LOCATION):
-                    serverconfig.read(SERVER_CONF_LOCATION)
-
-        if args.subcommand == 'create' or args.subcommand == 'update' or args.subcommand == 'mods':
+        SERVER_DIR = getServerPathFromName(SERVER_NAME, STATE, available=args.subcommand not in ['create', 'delete'])  # will return none if nonexistant
+        if SERVER_DIR is None and args.subcommand != 'create':
+            print("Server not found!")
+            exit(1)
+
+        if SERVER_DIR is not None:
+            serverconfig = loadServerConfig(STATE, SERVER_NAME)
+            SERVER_LIVE_DIR = getLiveDir(SERVER_DIR)
+
+        # what the state db holds, so saving only writes what this command changed
+        SERVER_SNAPSHOT = configToDict(serverconfig)
+
+        # mods are downloaded into the shared store if there is one, and linked into the server from there
+        if MOD_STORE is not None:
+            DOWNLOAD_DIR = MOD_STORE
+            DOWNLOAD_LOCK = lambda: lockStore(MOD_STORE)
+        else:
+            DOWNLOAD_DIR = SERVER_LIVE_DIR if SERVER_DIR is not None else None
+            DOWNLOAD_LOCK = contextlib.nullcontext
+
+        if args.subcommand == 'create' or args.subcommand == 'update' or args.subcommand == 'mods' or (args.subcommand == 'verify' and args.fix):
             if 'STEAM_USERNAME' not in locals():
-                STEAM_USERNAME = input("What is your steam username? ")
+                STEAM_USERNAME = prompt("What is your steam username? ")
 
             if 'STEAM_PASSWORD' not in locals():
-                STEAM_PASSWORD = getpass("What is your steam password? ")
+                STEAM_PASSWORD = prompt("What is your steam password? ", secret=True)
+
+            # one logged in steamcmd per worker, shared by everything this command downloads
+            STEAM_POOL = getSteamPool(STEAM_USERNAME, STEAM_PASSWORD, STEAM_WORKERS)
+
+            # timings of everything steamcmd downloads, summarized on exit
+            STEAM_TRACE = SteamTrace(STEAM_TRACE_FILE, SERVER_NAME)
+            atJobExit(STEAM_TRACE.close)
 
         if args.subcommand == 'create':
-            SERVER_DIR = input("Installation directory for server? ")
-            SERVER_CONF_LOCATION = SERVER_DIR + "/config.ini"
+            if SERVER_DIR is not None:
+                print("A server with that name already exists!")
+                exit(1)
+
+            SERVER_DIR = promptPath("Installation directory for server? ")
+            SERVER_OWNER = STATE.execute("SELECT name FROM servers WHERE path = ?", (SERVER_DIR,)).fetchone()
+            if SERVER_OWNER is not None:
+                print(SERVER_DIR + " is already used by server " + SERVER_OWNER[0] + "!")
+                exit(1)
 
             # automated steamcmd command
-            steam_success = getArmaServer(STEAM_USERNAME, STEAM_PASSWORD, SERVER_DIR)
+            steam_success = getArmaServer(STEAM_USERNAME, STEAM_PASSWORD, SERVER_DIR, trace=STEAM_TRACE)
 
             if steam_success == 0:
                 print("Server installed successfully")
@@ -254,55 +2847,186 @@ def main():
             serverconfig['server'] = {}
             serverconfig['server']['mods'] = ""
 
-            with open(SERVER_CONF_LOCATION, 'w') as serverconfig_file:
-                serverconfig.write(serverconfig_file)
-
-            if 'SERVER_LIST' not in locals():
-                SERVER_LIST = []
-                SERVER_LIST.append(SERVER_DIR)
+            SERVER_SNAPSHOT = saveServerConfig(STATE, SERVER_SNAPSHOT, serverconfig)
 
         if args.subcommand == 'update':
-            if 'SERVER_LIST' not in locals():
-                print("No servers are available!")
-                exit(1)
-
             if SERVER_DIR is None:
                 print("That server was not found!")
                 exit(1)
 
-            def updateMods():
-                EXISTING_MODS = serverconfig['server']['mods'].split(",")
-                steam_success = getSteamMods(STEAM_USERNAME, STEAM_PASSWORD, EXISTING_MODS, SERVER_DIR)
+            def updateMods(target):
+                download_dir = MOD_STORE if MOD_STORE is not None else target
+                EXISTING_MODS = splitMods(serverconfig['server']['mods'])
+                timestamps = getWorkshopTimestamps(EXISTING_MODS) if len(EXISTING_MODS) > 0 else {}
+                if timestamps is None:
+                    print("Could not reach the steam workshop, checking all mods")
 
-                if steam_success == 0:
+                # keeps dependencies, and so the instances' load order, up to date
+                WORKSHOP_ITEMS = readJsonFile(WORKSHOP_CACHE, {})
+                if getWorkshopItems(EXISTING_MODS, getWorkshopSource(), WORKSHOP_ITEMS) is not None:
+                    writeJsonFile(WORKSHOP_CACHE, WORKSHOP_ITEMS)
+
+                with DOWNLOAD_LOCK():
+                    if MOD_STORE is not None:
+                        linkStoreMods(MOD_STORE, SERVER_DIR, EXISTING_MODS, target)
+
+                    if args.force:
+                        STALE_MODS = EXISTING_MODS
+                    else:
+                        STALE_MODS = getStaleMods(download_dir, EXISTING_MODS, timestamps)
+
+                    if len(STALE_MODS) == 0:
+                        print("All mods are up to date")
+                        return
+
+                def commitMods(updated):
+                    printCollisions(lowercaseMods(download_dir, updated, STEAM_WORKERS))
+                    recordModManifest(download_dir, updated, timestamps)
+                    recordModHashes(download_dir, updated)
+                    if MOD_STORE is not None:
+                        linkStoreMods(MOD_STORE, SERVER_DIR, updated, target)
+
+                print("Updating %d of %d mod(s)" % (len(STALE_MODS), len(EXISTING_MODS)))
+                mod_results = getSteamMods(STEAM_USERNAME, STEAM_PASSWORD, STALE_MODS, download_dir, STEAM_WORKERS, STEAM_POOL, STEAM_TRACE, commitMods, isolated=args.staged, lock=DOWNLOAD_LOCK)
+
+                if printModResults(mod_results):
                     print("Mod(s) updated successfully")
                 else:
-                    exit(steam_success)
+                    exit(1)
+
+            def updateServer(target):
+                # a clean hash manifest means steamcmd doesn't have to re-check every file
+                SERVER_HASHES = target + "/" + SERVER_HASH_MANIFEST
+                SERVER_EXCLUDE = getServerHashExclude(serverconfig)
+                dirty = verifyHashManifest(target, SERVER_HASHES, SERVER_EXCLUDE, quick=True)
+                if dirty is not None and len(dirty) == 0:
+                    print("Server files match the hash manifest, skipping validation")
 
-            def updateServer():
-                steam_success = getArmaServer(STEAM_USERNAME, STEAM_PASSWORD, SERVER_DIR)
+                steam_success = getArmaServer(STEAM_USERNAME, STEAM_PASSWORD, target, STEAM_POOL, validate=dirty is None or len(dirty) > 0, trace=STEAM_TRACE)
 
                 if steam_success == 0:
+                    if dirty is not None:
+                        recordHashManifest(target, SERVER_HASHES, SERVER_EXCLUDE)
                     print("Server updated successfully")
                 else:
                     exit(steam_success)
 
-            if args.mods_only:
-                updateMods()
-            elif args.server_only:
-                updateServer()
+            def updateAll(target):
+                if args.mods_only:
+                    updateMods(target)
+                elif args.server_only:
+                    updateServer(target)
+                else:
+                    updateMods(target)
+                    updateServer(target)
+
+            if args.rollback:
+                if not rollbackServerVersion(SERVER_DIR):
+                    print("There is no previous version to roll back to")
+                    exit(1)
+
+                print("Rolled back to " + getLiveDir(SERVER_DIR))
+                restartInstancesRolling(SERVER_DIR)
+            elif args.staged:
+                # update a copy while instances keep running, then switch them over one by one
+                STAGING_DIR, STAGING_LINKED = stageServerVersion(SERVER_DIR, getServerHashExclude(serverconfig, SERVER_STATE_EXCLUDE))
+                print("Staging update in " + STAGING_DIR)
+                try:
+                    updateAll(STAGING_DIR)
+
+                    # the live server shares these files, they must only have been replaced
+                    STAGING_CHANGED = getChangedFiles(SERVER_LIVE_DIR, STAGING_LINKED)
+                    if len(STAGING_CHANGED) > 0:
+                        for path in STAGING_CHANGED:
+                            print(path + " was changed in place, the live server sees the change too")
+                        print("Not switching to the staged version")
+                        exit(1)
+                except BaseException:
+                    print("Discarding the staged version " + STAGING_DIR)
+                    shutil.rmtree(STAGING_DIR)
+                    raise
+
+                switchServerVersion(SERVER_DIR, STAGING_DIR)
+                pruneServerVersions(SERVER_DIR)
+                print("Switched to " + STAGING_DIR)
+                restartInstancesRolling(SERVER_DIR)
             else:
-                updateMods()
-                updateServer()
+                updateAll(SERVER_LIVE_DIR)
+
+        if args.subcommand == 'verify':
+            SERVER_HASHES = SERVER_LIVE_DIR + "/" + SERVER_HASH_MANIFEST
+            SERVER_EXCLUDE = getServerHashExclude(serverconfig)
+            SERVER_CORRUPT = False
+            CORRUPT_MODS = []
+
+            def reportCorrupt(item, bad):
+                if bad is None:
+                    print(item + ": no hash manifest yet, recording one")
+                    return False
+
+                for path in bad:
+                    print(item + ": " + path + " is missing or corrupt")
+                if len(bad) == 0:
+                    print(item + ": OK")
+
+                return len(bad) > 0
+
+            if not args.mods_only:
+                bad = verifyHashManifest(SERVER_LIVE_DIR, SERVER_HASHES, SERVER_EXCLUDE, full=args.full)
+                SERVER_CORRUPT = reportCorrupt("Server", bad)
+                if bad is None:
+                    recordHashManifest(SERVER_LIVE_DIR, SERVER_HASHES, SERVER_EXCLUDE)
+
+            if not args.server_only:
+                for mod_id in splitMods(serverconfig['server']['mods']):
+                    bad = verifyHashManifest(DOWNLOAD_DIR + "/" + SERVER_MOD_DIR + mod_id, DOWNLOAD_DIR + "/" + MOD_HASH_DIR + "/" + mod_id + ".json", full=args.full)
+                    if reportCorrupt("Mod " + mod_id, bad):
+                        CORRUPT_MODS.append(mod_id)
+                    if bad is None:
+                        recordModHashes(DOWNLOAD_DIR, [mod_id])
+
+            if args.fix and SERVER_CORRUPT:
+                steam_success = getArmaServer(STEAM_USERNAME, STEAM_PASSWORD, SERVER_LIVE_DIR, STEAM_POOL, trace=STEAM_TRACE)
+                if steam_success == 0:
+                    recordHashManifest(SERVER_LIVE_DIR, SERVER_HASHES, SERVER_EXCLUDE)
+                    SERVER_CORRUPT = False
+                    print("Server repaired")
+
+            if args.fix and len(CORRUPT_MODS) > 0:
+                with DOWNLOAD_LOCK():
+                    # steamcmd trusts its own records for workshop items, so corrupt ones are fetched from scratch
+                    for mod_id in CORRUPT_MODS:
+                        shutil.rmtree(DOWNLOAD_DIR + "/" + SERVER_MOD_DIR + mod_id, ignore_errors=True)
+
+                def commitRepairs(repaired):
+                    printCollisions(lowercaseMods(DOWNLOAD_DIR, repaired, STEAM_WORKERS))
+                    recordModManifest(DOWNLOAD_DIR, repaired)
+                    recordModHashes(DOWNLOAD_DIR, repaired)
+
+                mod_results = getSteamMods(STEAM_USERNAME, STEAM_PASSWORD, CORRUPT_MODS, DOWNLOAD_DIR, STEAM_WORKERS, STEAM_POOL, STEAM_TRACE, commitRepairs, lock=DOWNLOAD_LOCK)
+                printModResults(mod_results)
+                CORRUPT_MODS = [mod_id for mod_id in CORRUPT_MODS if not mod_results[mod_id]]
+
+            if SERVER_CORRUPT or len(CORRUPT_MODS) > 0:
+                exit(1)
 
         if args.subcommand == 'delete':
             if SERVER_DIR is None:
                 print("That server was not found!")
                 exit(1)
 
-            confirm = input("Are you sure you want to delete ALL CONTENTS of " + SERVER_DIR + "? [Y,n] ")
+            if os.path.isdir(SERVER_DIR):
+                confirm = prompt("Are you sure you want to delete ALL CONTENTS of " + SERVER_DIR + "? [Y,n] ")
+            else:
+                confirm = prompt(SERVER_DIR + " is missing, remove " + SERVER_NAME + " and its instances anyway? [Y,n] ")
             if confirm == "Y":
-                shutil.rmtree(SERVER_DIR)
+                if MOD_STORE is not None:
+                    with DOWNLOAD_LOCK():
+                        unlinkStoreMods(MOD_STORE, SERVER_DIR, serverconfig['server']['mods'].split(","))
+                if os.path.isdir(SERVER_DIR):
+                    shutil.rmtree(SERVER_DIR)
+                with stateTransaction(STATE):
+                    STATE.execute("DELETE FROM servers WHERE name = ?", (SERVER_NAME,))
 
         if args.subcommand == 'mods':
             if SERVER_DIR is None:
@@ -314,6 +3038,10 @@ def main():
                 if args.mod is not None:
                     # mods were added
                     for mod_url in args.mod:
+                        if mod_url.isdigit():
+                            mod_id_list.append(mod_url)
+                            continue
+
                         parsed_url = urlparse.urlparse(mod_url)
                         parsed_list = urlparse.parse_qs(parsed_url.query)
                         if 'id' in parsed_list:
@@ -322,49 +3050,99 @@ def main():
                             print("No ModID found in URL")
                             exit(1)
 
-                    steam_success = getSteamMods(STEAM_USERNAME, STEAM_PASSWORD, mod_id_list, SERVER_DIR)
-
-                    if steam_success == 0:
-                        print("Mod(s) installed successfully")
+                    # collections become their mods, and every mod brings what it requires
+                    WORKSHOP_ITEMS = readJsonFile(WORKSHOP_CACHE, {})
+                    RESOLVED_MODS = resolveWorkshopItems(mod_id_list, getWorkshopSource(), WORKSHOP_ITEMS)
+                    if RESOLVED_MODS is None:
+                        print("Could not reach the steam workshop, adding the mods without their dependencies")
                     else:
-                        exit(steam_success)
+                        writeJsonFile(WORKSHOP_CACHE, WORKSHOP_ITEMS)
+                        EXTRA_MODS = [mod_id for mod_id in RESOLVED_MODS if mod_id not in mod_id_list]
+                        if len(EXTRA_MODS) > 0:
+                            print("Also adding %d mod(s) from collections and dependencies: %s" % (len(EXTRA_MODS), ", ".join(EXTRA_MODS)))
+                        mod_id_list = RESOLVED_MODS
+
+                    def addServerMods(installed):
+                        # installed mods go into the server config right away, so a failure later doesn't lose them
+                        nonlocal SERVER_SNAPSHOT
+                        if MOD_STORE is not None:
+                            linkStoreMods(MOD_STORE, SERVER_DIR, installed)
+
+                        EXISTING_MODS = serverconfig['server']['mods'].split(",")
+                        EXISTING_EXCLUSIVE = list(set(EXISTING_MODS) - set(installed))
+                        NEW_MODS = EXISTING_EXCLUSIVE + installed
+                        NEW_MODS = [string for string in NEW_MODS if string != ""]  # remove empty string from empty set (if they're there)
+
+                        serverconfig['server']['mods'] = ",".join(NEW_MODS)
+
+                        SERVER_SNAPSHOT = saveServerConfig(STATE, SERVER_SNAPSHOT, serverconfig)
 
-                    # lowercase installed mods
-                    for mod_id in mod_id_list:
-                        path = SERVER_DIR + "/" + SERVER_MOD_DIR + mod_id
-                        lowercase_all(path)
+                    def commitMods(installed):
+                        # lowercase installed mods
+                        printCollisions(lowercaseMods(DOWNLOAD_DIR, installed, STEAM_WORKERS))
 
-                    EXISTING_MODS = serverconfig['server']['mods'].split(",")
-                    EXISTING_EXCLUSIVE = list(set(EXISTING_MODS) - set(mod_id_list))
-                    NEW_MODS = EXISTING_EXCLUSIVE + mod_id_list
-                    NEW_MODS = [string for string in NEW_MODS if string != ""]  # remove empty string from empty set (if they're there)
-                    
-                    serverconfig['server']['mods'] = ",".join(NEW_MODS)
+                        recordModManifest(DOWNLOAD_DIR, installed, TIMESTAMPS)
+                        recordModHashes(DOWNLOAD_DIR, installed)
+                        addServerMods(installed)
 
-                    with open(SERVER_CONF_LOCATION, 'w') as serverconfig_file:
-                        serverconfig.write(serverconfig_file)
+                    with DOWNLOAD_LOCK():
+                        # mods another server already put in the store don't need downloading
+                        NEEDED_MODS = mod_id_list
+                        if MOD_STORE is not None:
+                            NEEDED_MODS = [mod_id for mod_id in mod_id_list if not os.path.isdir(MOD_STORE + "/" + SERVER_MOD_DIR + mod_id)]
+                            addServerMods([mod_id for mod_id in mod_id_list if mod_id not in NEEDED_MODS])
+
+                    TIMESTAMPS = getWorkshopTimestamps(NEEDED_MODS) if len(NEEDED_MODS) > 0 else {}
+                    mod_results = getSteamMods(STEAM_USERNAME, STEAM_PASSWORD, NEEDED_MODS, DOWNLOAD_DIR, STEAM_WORKERS, STEAM_POOL, STEAM_TRACE, commitMods, lock=DOWNLOAD_LOCK)
+
+                    if printModResults(mod_results):
+                        print("Mod(s) installed successfully")
+                    else:
+                        exit(1)
 
             if args.subtask == 'delete':
+                if MOD_STORE is not None:
+                    with DOWNLOAD_LOCK():
+                        RELEASED_MODS, FREED_MODS = unlinkStoreMods(MOD_STORE, SERVER_DIR, args.mod)
+
                 for mod in args.mod:
-                    path = SERVER_DIR + "/" + SERVER_MOD_DIR + mod
-                    if os.path.isdir(path):
+                    path = SERVER_LIVE_DIR + "/" + SERVER_MOD_DIR + mod
+                    if os.path.isdir(path) and not os.path.islink(path):
                         shutil.rmtree(path)
                         print("Removed " + mod)
+                    elif MOD_STORE is not None and mod in RELEASED_MODS:
+                        print("Removed " + mod + (" and its shared copy" if mod in FREED_MODS else ", the shared copy is still in use"))
+
+                recordModManifest(SERVER_LIVE_DIR, args.mod)  # drops the deleted mods
+                recordModHashes(SERVER_LIVE_DIR, args.mod)
+
+                # deleted mods can't stay enabled anywhere
+                for mod in args.mod:
+                    for server, instance in getInstancesUsingMod(STATE, mod, SERVER_NAME):
+                        serverconfig[instance]['mods'] = ",".join(mod_id for mod_id in splitMods(serverconfig[instance]['mods']) if mod_id != mod)
+                        print("Disabled " + mod + " on instance " + instance)
+
+                serverconfig['server']['mods'] = ",".join(mod_id for mod_id in splitMods(serverconfig['server']['mods']) if mod_id not in args.mod)
+                SERVER_SNAPSHOT = saveServerConfig(STATE, SERVER_SNAPSHOT, serverconfig)
+
+                for instance in getInstances(serverconfig):
+                    syncInstanceLinks(SERVER_DIR, serverconfig, instance)
+                syncServerKeys(SERVER_DIR, serverconfig)
+
+            if args.subtask == 'instances':
+                print("Server\t\tInstance")
+                for server, instance in getInstancesUsingMod(STATE, args.mod[0]):
+                    print(server + "\t\t" + instance)
 
             if args.subtask == 'list':
                 EXISTING_MODS = serverconfig['server']['mods'].split(",")
-
-                print("Workshop ID\t\tMod Name")
-                for mod in EXISTING_MODS:
-                    path = SERVER_DIR + "/" + SERVER_MOD_DIR + mod
-                    name = getModName(path)
-                    print(mod + "\t\t" + name)
+                printModList(SERVER_LIVE_DIR, EXISTING_MODS)
 
         if args.subcommand == 'instance':
-            if args.subtask != 'list':
+            if args.subtask != 'list' and args.subtask != 'supervise' and args.subtask != 'monitor':
                 INSTANCE_NAME = args.i_name[0]
 
-            if args.subtask == 'mods' or args.subtask == 'delete' or args.subtask == 'start':
+            if args.subtask == 'mods' or args.subtask == 'delete' or args.subtask == 'start' or args.subtask == 'stop' or args.subtask == 'stats':
                 if INSTANCE_NAME not in serverconfig:
                     print("Instance not found!")
                     exit(1)
@@ -374,7 +3152,7 @@ def main():
 
                 # get location
                 DEF_LOC = SERVER_DIR + "/instances/" + INSTANCE_NAME
-                INSTANCE_DIR = input("Location of new isntance [" + DEF_LOC + "]? ")
+                INSTANCE_DIR = promptPath("Location of new isntance [" + DEF_LOC + "]? ")
                 if INSTANCE_DIR == "":
                     INSTANCE_DIR = DEF_LOC
                 
@@ -382,15 +3160,14 @@ def main():
                 os.makedirs(INSTANCE_DIR, exist_ok=True)
 
                 # copy template conf file
-                shutil.copyfile("server.cfg.template", INSTANCE_DIR + "/server.cfg")
+                shutil.copyfile(SERVER_CFG_TEMPLATE, INSTANCE_DIR + "/server.cfg")
 
                 serverconfig[INSTANCE_NAME] = {}
                 serverconfig[INSTANCE_NAME]['path'] = INSTANCE_DIR
                 serverconfig[INSTANCE_NAME]['mods'] = ""
                 serverconfig[INSTANCE_NAME]['port'] = "2302"
 
-                with open(SERVER_CONF_LOCATION, 'w') as serverconfig_file:
-                    serverconfig.write(serverconfig_file)
+                SERVER_SNAPSHOT = saveServerConfig(STATE, SERVER_SNAPSHOT, serverconfig)
 
                 print("Instance created")
 
@@ -406,8 +3183,7 @@ def main():
                         serverconfig[INSTANCE_NAME][field] = value
                         print("Setting parameter '%s' to '%s' for instance '%s'" % (field, value, INSTANCE_NAME))
 
-                with open(SERVER_CONF_LOCATION, 'w') as serverconfig_file:
-                            serverconfig.write(serverconfig_file)
+                SERVER_SNAPSHOT = saveServerConfig(STATE, SERVER_SNAPSHOT, serverconfig)
 
             if args.subtask == 'mods':
                 # modify instance
@@ -445,8 +3221,7 @@ def main():
                         
                         serverconfig[INSTANCE_NAME]['mods'] = ",".join(NEW_MODS)
 
-                        with open(SERVER_CONF_LOCATION, 'w') as serverconfig_file:
-                            serverconfig.write(serverconfig_file)
+                        SERVER_SNAPSHOT = saveServerConfig(STATE, SERVER_SNAPSHOT, serverconfig)
                 elif args.subsubtask == 'disable':
                     if args.mod is not None:
                         # mods to be disabled
@@ -476,19 +3251,16 @@ def main():
                         
                         serverconfig[INSTANCE_NAME]['mods'] = ",".join(NEW_MODS)
 
-                        with open(SERVER_CONF_LOCATION, 'w') as serverconfig_file:
-                            serverconfig.write(serverconfig_file)
+                        SERVER_SNAPSHOT = saveServerConfig(STATE, SERVER_SNAPSHOT, serverconfig)
                 
+                if args.subsubtask == 'enable' or args.subsubtask == 'disable':
+                    syncInstanceLinks(SERVER_DIR, serverconfig, INSTANCE_NAME)
+                    syncServerKeys(SERVER_DIR, serverconfig)
+
                 if args.subsubtask == 'list':
-                    serverconfig = configparser.ConfigParser()
-                    serverconfig.read(SERVER_CONF_LOCATION)
+                    serverconfig = loadServerConfig(STATE, SERVER_NAME)
                     EXISTING_MODS = serverconfig[INSTANCE_NAME]['mods'].split(",")
-
-                    print("Workshop ID\t\tMod Name")
-                    for mod in EXISTING_MODS:
-                        path = SERVER_DIR + "/" + SERVER_MOD_DIR + mod
-                        name = getModName(path)
-                        print(mod + "\t\t" + name)
+                    printModList(SERVER_LIVE_DIR, EXISTING_MODS)
             
             if args.subtask == 'start':
                 # start an instance
@@ -500,22 +3272,112 @@ def main():
                 INSTANCE_DIR = serverconfig[INSTANCE_NAME]['path']
                 INSTANCE_PORT = serverconfig[INSTANCE_NAME]['port']
 
-                INSTANCE_MODS = serverconfig[INSTANCE_NAME]['mods'].split(",")
-                INSTANCE_MODS_RELATIVE = [SERVER_MOD_DIR + sub for sub in INSTANCE_MODS]
+                syncServerKeys(SERVER_DIR, serverconfig)
+                INSTANCE_MODS_RELATIVE = syncInstanceLinks(SERVER_DIR, serverconfig, INSTANCE_NAME)
+
+                INSTANCE_HEADLESS, INSTANCE_CORES = getInstanceCpus(serverconfig, INSTANCE_NAME)
+
+                INSTANCE_OWNER = claimInstance(SERVER_DIR, INSTANCE_NAME, pid=os.getpid(), status="starting", supervisor=None)
+                if INSTANCE_OWNER is not None:
+                    print("Instance %s is already running (pid %d)!" % (INSTANCE_NAME, INSTANCE_OWNER))
+                    exit(1)
+
+                startServer(SERVER_DIR, INSTANCE_DIR, INSTANCE_PORT, INSTANCE_MODS_RELATIVE, INSTANCE_NAME, INSTANCE_HEADLESS, INSTANCE_CORES, getInstancePrewarm(serverconfig, INSTANCE_NAME))
+
+            if args.subtask == 'supervise':
+                INSTANCE_NAMES = args.i_name if len(args.i_name) > 0 else getInstances(serverconfig)
 
-                startServer(SERVER_DIR, INSTANCE_DIR, INSTANCE_PORT, INSTANCE_MODS_RELATIVE)
+                SUPERVISED = {}
+                for instance in INSTANCE_NAMES:
+                    if instance not in serverconfig:
+                        print("Instance " + instance + " not found!")
+                        exit(1)
+
+                    SUPERVISED[instance] = (serverconfig[instance]['path'], serverconfig[instance]['port'], syncInstanceLinks(SERVER_DIR, serverconfig, instance)) + getInstanceCpus(serverconfig, instance) + (getInstancePrewarm(serverconfig, instance),)
+
+                syncServerKeys(SERVER_DIR, serverconfig)
+
+                asyncio.run(superviseInstances(SERVER_DIR, SUPERVISED))
+
+            if args.subtask == 'stop':
+                INSTANCE_STATE = readInstanceState(SERVER_DIR).get(INSTANCE_NAME, {})
+                if getInstanceStatus(INSTANCE_STATE) not in ["running", "backoff"]:
+                    print("Instance is not running")
+                    exit(1)
+
+                # tell the supervisor not to restart it, then ask the server to shut down
+                updateInstanceState(SERVER_DIR, INSTANCE_NAME, desired="stopped")
+                if isPidAlive(INSTANCE_STATE.get("pid")):
+                    os.kill(INSTANCE_STATE["pid"], signal.SIGTERM)
+                else:
+                    updateInstanceState(SERVER_DIR, INSTANCE_NAME, status="stopped")
+                print("Stopping instance " + INSTANCE_NAME)
+
+            if args.subtask == 'stats':
+                INSTANCE_DIR = serverconfig[INSTANCE_NAME]['path']
+                STATS_FILE = INSTANCE_DIR + "/" + INSTANCE_LOG_STATS
+
+                LOG_STATS = {"positions": {}, "summary": newLogSummary()}
+                if not args.reset:
+                    LOG_STATS = readJsonFile(STATS_FILE, LOG_STATS)
+
+                if args.follow:
+                    try:
+                        while True:
+                            collectLogEvents(SERVER_DIR, INSTANCE_DIR, LOG_STATS, lambda event: print(json.dumps(event), flush=True))
+                            writeJsonFile(STATS_FILE, LOG_STATS)
+                            time.sleep(1)
+                    except KeyboardInterrupt:
+                        pass
+                else:
+                    collectLogEvents(SERVER_DIR, INSTANCE_DIR, LOG_STATS)
+
+                writeJsonFile(STATS_FILE, LOG_STATS)
+                printLogSummary(LOG_STATS["summary"])
+
+            if args.subtask == 'monitor':
+                SAMPLED = {}
+                SAMPLED_LOCK = threading.Lock()
+
+                def getMetrics():
+                    with SAMPLED_LOCK:
+                        return formatPrometheusMetrics(SERVER_NAME, SAMPLED)
+
+                if args.http is not None:
+                    serveMetrics(args.http, getMetrics)
+                    print("Serving metrics on http://127.0.0.1:%d/metrics" % args.http)
+
+                try:
+                    while True:
+                        with SAMPLED_LOCK:
+                            sampleInstances(SERVER_DIR, SAMPLED, args.samples)
+                            if not args.quiet:
+                                printInstanceSamples(SAMPLED)
+                                print()
+                        time.sleep(args.interval)
+                except KeyboardInterrupt:
+                    pass
 
             if args.subtask == 'list':
-                print("Instance Name\t\tPath")
+                INSTANCE_STATES = readInstanceState(SERVER_DIR)
+                print("Instance Name\t\tStatus\t\tPID\tRestarts\tHC\tCPUs\tPath")
 
-                for header in serverconfig.keys():
-                    if header != "general" and header != "server" and header != "DEFAULT":
-                        print(header + "\t\t" + serverconfig[header]['path'])
+                for header in getInstances(serverconfig):
+                    state = INSTANCE_STATES.get(header, {})
+                    status = getInstanceStatus(state)
+                    pid = str(state["pid"]) if status == "running" else "-"
+                    cpus = ",".join(str(cpu) for cpu in state.get("cpus", [])) if status == "running" and len(state.get("cpus", [])) > 0 else "-"
+                    print(header + "\t\t" + status + "\t\t" + pid + "\t" + str(state.get("restarts", 0)) + "\t\t" + str(getInstanceCpus(serverconfig, header)[0]) + "\t" + cpus + "\t" + serverconfig[header]['path'])
 
             if args.subtask == 'delete':
-                confirm = input("Are you sure you want to delete ALL CONTENTS of " + INSTANCE_DIR + "? [Y,n] ")
+                INSTANCE_DIR = serverconfig[INSTANCE_NAME]['path']
+                confirm = prompt("Are you sure you want to delete ALL CONTENTS of " + INSTANCE_DIR + "? [Y,n] ")
                 if confirm == "Y":
-                    shutil.rmtree(INSTANCE_DIR)
+                    shutil.rmtree(INSTANCE_DIR, ignore_errors=True)
+                    shutil.rmtree(SERVER_LIVE_DIR + "/" + SERVER_LINKS_DIR + "/" + INSTANCE_NAME, ignore_errors=True)
+                    serverconfig.remove_section(INSTANCE_NAME)
+                    SERVER_SNAPSHOT = saveServerConfig(STATE, SERVER_SNAPSHOT, serverconfig)
+                    syncServerKeys(SERVER_DIR, serverconfig)
 
         # update config
         if args.save:
@@ -526,15 +3388,10 @@ def main():
             if 'STEAM_PASSWORD' in locals():
                 config['steam']['password'] = STEAM_PASSWORD
 
-        config['state'] = {}
-        if 'SERVER_LIST' in locals():
-            config['state']['serverlist'] = ",".join(SERVER_LIST)
-
-        # check to make sure dir exists
-        os.makedirs(CONFIG_FILE_MAIN_DIR, exist_ok=True)
+            if STEAM_WORKERS != 1:
+                config['steam']['workers'] = str(STEAM_WORKERS)
 
-        with open(CONFIG_FILE_MAIN, 'w') as config_file:
-            config.write(config_file)
+            writeMainConfig(config)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# times arma3.py against synthetic installations, using stub steamcmd and arma3server executables so nothing
+# is downloaded or run for real. results are written to a JSON file and checked against a baseline if given
+import os
+import sys
+import argparse
+import json
+import time
+import shutil
+import random
+import tempfile
+import platform
+import subprocess
+import contextlib
+import configparser
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+NOISE_FLOOR = 0.01  # seconds, slowdowns smaller than this aren't counted as regressions
+
+# one-shot "+cmd args" mode and the interactive Steam> prompt, like the real one.
+# downloads write a mixed-case tree of BENCH_FILES files so lowercasing has work to do, items listed in
+# BENCH_STEAMCMD_SILENT get no output at all. commands are logged to BENCH_STEAMCMD_LOG if it's set
+STUB_STEAMCMD = r'''#!/usr/bin/env python3
+import os, re, sys, json, time, shlex
+state = {"dir": ".", "user": None}
+print("Redirecting stderr to '/dev/null'\nLoading Steam API...OK", flush=True)
+
+def download(mod_id):
+    path = os.path.join(state["dir"], "steamapps/workshop/content/107410", mod_id)
+    size = 0
+    for i in range(int(os.getenv("BENCH_FILES", "20"))):
+        folder = os.path.join(path, "Addons", "Sub_Folder_%d" % (i % 4))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "Data_File_%d.PBO" % i), "w") as data:
+            size += data.write("x" * 256)
+    with open(os.path.join(path, "mod.cpp"), "w") as meta:
+        meta.write('name = "Synthetic Mod %s";\n' % mod_id)
+
+    # steamcmd keeps track of installed items in the install dir's acf
+    acf_file = os.path.join(state["dir"], "steamapps/workshop/appworkshop_107410.acf")
+    items = {}
+    if os.path.isfile(acf_file):
+        with open(acf_file) as acf:
+            items = dict((item[0], item[1:]) for item in re.findall(r'"(\d+)"\s*{\s*"size"\s*"(\d+)"\s*"timeupdated"\s*"(\d+)"\s*"manifest"\s*"(\d+)"', acf.read()))
+    items[mod_id] = (size, int(time.time()), abs(hash(mod_id)))
+    with open(acf_file, "w") as acf:
+        acf.write('"AppWorkshop"\n{\n\t"appid"\t\t"107410"\n\t"WorkshopItemsInstalled"\n\t{\n')
+        for item_id, (item_size, updated, manifest) in items.items():
+            acf.write('\t\t"%s"\n\t\t{\n\t\t\t"size"\t\t"%s"\n\t\t\t"timeupdated"\t\t"%s"\n\t\t\t"manifest"\t\t"%s"\n\t\t}\n' % (item_id, item_size, updated, manifest))
+        acf.write('\t}\n}\n')
+    return size
+
+def do(cmd, args):
+    if cmd == "force_install_dir":
+        if state.get("user"):
+            # the real one ignores it once logged in
+            print("Please use force_install_dir before logon!")
+        else:
+            state["dir"] = args[0]
+    elif cmd == "logout":
+        state["user"] = None
+    elif cmd == "login":
+        if len(args) == 1:
+            # like the real one, asks for the password if it isn't given
+            sys.stdout.write("password: ")
+            sys.stdout.flush()
+            args.append(sys.stdin.readline().rstrip("\n"))
+        print("Logging in user '%s' to Steam Public...OK\nWaiting for user info...OK" % args[0])
+        state["user"] = args[0]
+    elif cmd == "workshop_download_item":
+        # says nothing at all about silent items
+        if args[1] not in os.getenv("BENCH_STEAMCMD_SILENT", "").split(","):
+            print("Downloading item %s ..." % args[1])
+            size = download(args[1])
+            print('Success. Downloaded item %s to "%s" (%d bytes)' % (args[1], state["dir"], size))
+    elif cmd == "app_update":
+        os.makedirs(state["dir"], exist_ok=True)
+        print("Success! App '233780' fully installed.")
+
+    if os.getenv("BENCH_STEAMCMD_LOG"):
+        # every command with the steamcmd it went to, for tests to check what was asked
+        with open(os.getenv("BENCH_STEAMCMD_LOG"), "a") as log:
+            log.write(json.dumps({"pid": os.getpid(), "cmd": cmd, "args": args}) + "\n")
+
+args = sys.argv[1:]
+if args:
+    commands = []
+    for arg in args:
+        if arg.startswith("+"):
+            commands.append([arg[1:]])
+        else:
+            commands[-1].append(arg)
+    for command in commands:
+        if command[0] != "quit":
+            do(command[0], command[1:])
+    sys.exit(0)
+
+while True:
+    sys.stdout.write("\nSteam>")
+    sys.stdout.flush()
+    line = sys.stdin.readline()
+    words = shlex.split(line) if line else []
+    if not line or words[:1] == ["quit"]:
+        break
+    if words:
+        do(words[0], words[1:])
+'''
+
+# stays up until it's told to stop, like a server
+STUB_ARMA3SERVER = r'''#!/usr/bin/env python3
+import signal, sys
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+signal.pause()
+'''
+
+def writeStub(path, source):
+    with open(path, "w") as stub:
+        stub.write(source)
+    os.chmod(path, 0o755)
+
+def makeEnvironment(work, files=20):
+    # stubs, a home with steam credentials and the environment arma3.py should run with in work.
+    # arma3.py reads these when it's imported, so they have to be set before that
+    os.makedirs(work + "/bin")
+    os.makedirs(work + "/home/.config/arma3_wrapper")
+    writeStub(work + "/bin/steamcmd", STUB_STEAMCMD)
+    writeStub(work + "/bin/arma3server", STUB_ARMA3SERVER)
+    with open(work + "/home/.config/arma3_wrapper/config.ini", "w") as config:
+        config.write("[steam]\nuser = bench\npassword = bench\n")
+
+    env = dict(os.environ)
+    env["HOME"] = work + "/home"
+    env["ARMA3_STEAMCMD"] = work + "/bin/steamcmd"
+    env["ARMA3_SERVER_BINARY"] = work + "/bin/arma3server"
+    env["ARMA3_WORKSHOP_FIXTURE"] = work + "/workshop.json"
+    env["ARMA3_CPU_PLAN"] = work + "/cpus.json"
+    env["ARMA3_DAEMON_SOCKET"] = work + "/daemon.sock"
+    env["BENCH_FILES"] = str(files)
+    return env
+
+def makeModTree(path, mod_id, files, depth, rng):
+    # a mod the way the workshop delivers it: mixed-case folders and files several levels deep, with mod.cpp and meta.cpp
+    for i in range(files):
+        folder = path + "/Addons"
+        for level in range(rng.randint(1, depth)):
+            folder += "/%s_Folder_%d" % (rng.choice(["Data", "Sounds", "Textures", "Scripts"]), (i + level) % 5)
+        os.makedirs(folder, exist_ok=True)
+        with open(folder + "/%s_%d.%s" % (rng.choice(["Mission", "Vehicle", "Unit"]), i, rng.choice(["PBO", "Bisign", "pbo"])), "w") as data:
+            data.write("x" * rng.randint(64, 1024))
+
+    with open(path + "/mod.cpp", "w") as meta:
+        meta.write('name = "Synthetic Mod %s";\npicture = "logo_ca.paa";\nactionName = "Website";\n' % mod_id)
+    with open(path + "/meta.cpp", "w") as meta:
+        # timestamps are .NET DateTime ticks
+        meta.write('protocol = 1;\npublishedid = %s;\nname = "Synthetic Mod %s";\ntimestamp = %d;\n' % (mod_id, mod_id, 621355968000000000 + rng.randint(1400000000, 1700000000) * 10000000))
+
+def makeMods(dir, mod_ids, files, depth, seed):
+    rng = random.Random(seed)
+    for mod_id in mod_ids:
+        makeModTree(dir + "/steamapps/workshop/content/107410/" + mod_id, mod_id, files, depth, rng)
+
+def timeIt(function, repeat, setup=None):
+    # best of repeat runs, setup runs before each one and isn't timed
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+def runCli(env, args, stdin=""):
+    arma3_run = subprocess.run([sys.executable, REPO_DIR + "/arma3.py"] + args, input=stdin, env=env, cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if arma3_run.returncode != 0:
+        print(arma3_run.stdout)
+        raise RuntimeError("arma3.py " + " ".join(args) + " failed with code %d" % arma3_run.returncode)
+
+def benchmarkInternals(arma3, work, args, results):
+    dir = work + "/internals"
+    mod_ids = [str(1000000 + i) for i in range(args.mods)]
+    content = dir + "/steamapps/workshop/content/107410/"
+    indexes = {}
+
+    def freshMods():
+        shutil.rmtree(dir, ignore_errors=True)
+        makeMods(dir, mod_ids, args.files, args.depth, args.seed)
+        indexes.clear()
+
+    def lowercaseAll():
+        for mod_id in mod_ids:
+            arma3.lowercase_all(content + mod_id, indexes.setdefault(mod_id, {}))
+
+    print("Generating %d mods with %d files each" % (args.mods, args.files))
+    results["lowercase_all_cold"] = {"seconds": timeIt(lowercaseAll, args.repeat, freshMods), "ops": args.mods}
+    results["lowercase_all_unchanged"] = {"seconds": timeIt(lowercaseAll, args.repeat), "ops": args.mods}
+
+    def listMods():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            arma3.printModList(dir, mod_ids)
+
+    def dropModCache():
+        if os.path.isfile(dir + "/" + arma3.SERVER_MOD_CACHE):
+            os.remove(dir + "/" + arma3.SERVER_MOD_CACHE)
+
+    results["mod_list_uncached"] = {"seconds": timeIt(listMods, args.repeat, dropModCache), "ops": args.mods}
+    results["mod_list_cached"] = {"seconds": timeIt(listMods, args.repeat), "ops": args.mods}
+
+    # many installations in the state db, each with a directory so lookups don't drop them
+    db = arma3.openStateDb()
+    for i in range(args.servers):
+        server_dir = work + "/servers/" + str(i)
+        os.makedirs(server_dir, exist_ok=True)
+        serverconfig = configparser.ConfigParser()
+        serverconfig.read_dict({"general": {"name": "server" + str(i), "path": server_dir}, "server": {"mods": ",".join(mod_ids[:10])}})
+        arma3.saveServerConfig(db, {}, serverconfig)
+
+    rng = random.Random(args.seed)
+    names = ["server" + str(rng.randrange(args.servers)) for i in range(args.lookups)]
+
+    def lookupServers():
+        for name in names:
+            arma3.getServerPathFromName(name, db)
+
+    results["server_lookup"] = {"seconds": timeIt(lookupServers, args.repeat), "ops": args.lookups}
+    db.close()
+
+def benchmarkFlows(arma3, work, env, args, results):
+    server_dir = work + "/flow"
+    mod_ids = [str(2000000 + i) for i in range(args.flow_mods)]
+
+    # workshop metadata for the mods, so resolving and update checks stay offline
+    fixture = {mod_id: {"title": "Synthetic Mod " + mod_id, "collection": False, "children": [], "updated": 1600000000} for mod_id in mod_ids}
+    with open(env["ARMA3_WORKSHOP_FIXTURE"], "w") as fixture_file:
+        json.dump(fixture, fixture_file)
+
+    start = time.perf_counter()
+    runCli(env, ["create", "bench"], server_dir + "\n")
+    results["create"] = {"seconds": time.perf_counter() - start, "ops": 1}
+
+    start = time.perf_counter()
+    runCli(env, ["-j", str(args.workers), "mods", "bench", "add"] + mod_ids)
+    results["mods_add"] = {"seconds": time.perf_counter() - start, "ops": args.flow_mods}
+
+    results["update_up_to_date"] = {"seconds": timeIt(lambda: runCli(env, ["update", "bench", "--mods-only"]), args.repeat), "ops": args.flow_mods}
+    results["update_force"] = {"seconds": timeIt(lambda: runCli(env, ["-j", str(args.workers), "update", "bench", "--mods-only", "--force"]), args.repeat), "ops": args.flow_mods}
+
+    runCli(env, ["instance", "bench", "add", "one"], "\n")
+    runCli(env, ["instance", "bench", "mods", "one", "enable"] + mod_ids)
+
+    def startInstance():
+        # until the instance is up, then stop it again
+        supervise_run = subprocess.Popen([sys.executable, REPO_DIR + "/arma3.py", "instance", "bench", "supervise", "one"], env=env, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        while arma3.getInstanceStatus(arma3.readInstanceState(server_dir).get("one", {})) != "running":
+            if supervise_run.poll() is not None:
+                raise RuntimeError("instance supervise exited with code %d" % supervise_run.returncode)
+            time.sleep(0.005)
+
+        stop = time.perf_counter()
+        runCli(env, ["instance", "bench", "stop", "one"])
+        supervise_run.wait()
+        return stop
+
+    def timeStart():
+        start = time.perf_counter()
+        return startInstance() - start
+
+    results["instance_start"] = {"seconds": min(timeStart() for i in range(args.repeat)), "ops": 1}
+
+def compareBaseline(results, baseline, tolerance):
+    # marks every benchmark that got slower than tolerance times its baseline, returns their names
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            continue
+
+        result["baseline"] = before["seconds"]
+        result["ratio"] = result["seconds"] / before["seconds"] if before["seconds"] > 0 else None
+        result["regressed"] = result["seconds"] > before["seconds"] * tolerance and result["seconds"] - before["seconds"] > NOISE_FLOOR
+        if result["regressed"]:
+            regressions.append(name)
+
+    return regressions
+
+def printResults(results):
+    print("Benchmark\t\t\tSeconds\t\tPer op\t\tBaseline")
+    for name, result in results.items():
+        baseline = "%.4f (%.2fx)%s" % (result["baseline"], result["ratio"] or 0, " REGRESSED" if result["regressed"] else "") if "baseline" in result else "-"
+        print("%-24s\t%.4f\t\t%.6f\t%s" % (name, result["seconds"], result["seconds"] / result["ops"], baseline))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark arma3.py against synthetic installations")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="Results of an earlier run to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="How many times slower than the baseline counts as a regression")
+    parser.add_argument("--mods", type=int, default=2000, help="Number of synthetic mods for lowercasing and listing")
+    parser.add_argument("--files", type=int, default=20, help="Files per synthetic mod")
+    parser.add_argument("--depth", type=int, default=4, help="Maximum folder depth within a mod")
+    parser.add_argument("--servers", type=int, default=1000, help="Number of installations in the state db")
+    parser.add_argument("--lookups", type=int, default=10000, help="Server lookups to time")
+    parser.add_argument("--flow-mods", type=int, default=50, help="Mods added and updated through the CLI")
+    parser.add_argument("-j", "--workers", type=int, default=4, help="Parallel steamcmd workers for the CLI flows")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the best one counts")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic trees")
+    parser.add_argument("--skip-flows", help="Only time the functions, not the CLI flows", action="store_true")
+    parser.add_argument("--keep", help="Keep the synthetic installations instead of deleting them", action="store_true")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="arma3-bench-")
+    env = makeEnvironment(work, args.files)
+    os.environ.update(env)
+    sys.path.insert(0, REPO_DIR)
+    import arma3
+
+    results = {}
+    try:
+        benchmarkInternals(arma3, work, args, results)
+        if not args.skip_flows:
+            benchmarkFlows(arma3, work, env, args, results)
+    finally:
+        if args.keep:
+            print("Synthetic installations kept in " + work)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = compareBaseline(results, json.load(baseline_file), args.tolerance)
+
+    meta = {key: value for key, value in vars(args).items() if key in ["mods", "files", "depth", "servers", "lookups", "flow_mods", "workers", "repeat", "seed"]}
+    meta["python"] = platform.python_version()
+    meta["platform"] = platform.platform()
+    meta["time"] = int(time.time())
+    with open(args.output, "w") as output:
+        json.dump({"meta": meta, "tolerance": args.tolerance, "results": results, "regressions": regressions}, output, indent=1)
+
+    printResults(results)
+    if len(regressions) > 0:
+        print("Regressed: " + ", ".join(regressions))
+        exit(1)
+
+if __name__ == '__main__':
+    main()
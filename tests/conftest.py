@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import benchmark
+
+# arma3.py reads its paths from the environment when it's imported, so the stubs and a scratch home come first
+WORK = tempfile.mkdtemp(prefix="arma3-test-")
+ENV = benchmark.makeEnvironment(WORK, files=4)
+ENV["BENCH_STEAMCMD_LOG"] = WORK + "/steamcmd.log"
+os.environ.update(ENV)
+
+import arma3
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORK, ignore_errors=True)
+
+@pytest.fixture
+def steamcmd_log():
+    # the commands the stub steamcmd got during the test, as {"pid", "cmd", "args"}
+    if os.path.isfile(ENV["BENCH_STEAMCMD_LOG"]):
+        os.remove(ENV["BENCH_STEAMCMD_LOG"])
+
+    def read():
+        if not os.path.isfile(ENV["BENCH_STEAMCMD_LOG"]):
+            return []
+        with open(ENV["BENCH_STEAMCMD_LOG"]) as log:
+            return [json.loads(line) for line in log]
+
+    return read
+
+@pytest.fixture
+def cli():
+    # runs arma3.py with the stubs, returns the completed process
+    def run(args, stdin="", check=True, env={}):
+        arma3_run = subprocess.run([sys.executable, REPO_DIR + "/arma3.py"] + args, input=stdin, env=dict(ENV, **env), cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=60)
+        if check:
+            assert arma3_run.returncode == 0, arma3_run.stdout
+        return arma3_run
+
+    return run
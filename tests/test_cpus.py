@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from conftest import arma3
+
+@pytest.fixture(autouse=True)
+def plan(tmp_path, monkeypatch):
+    monkeypatch.setattr(arma3, "CPU_PLAN_FILE", str(tmp_path / "cpus.json"))
+    return str(tmp_path / "cpus.json")
+
+def test_unpinned_instances_stay_out_of_the_plan(plan, capsys):
+    allocation = arma3.allocateInstanceCpus("/srv/a", "one", 2, 0)
+
+    assert allocation == {"server": [], "hc0": [], "hc1": []}
+    assert capsys.readouterr().out == ""
+    assert arma3.readJsonFile(plan, None) == {}
+
+def test_cores_are_not_shared(plan):
+    first = arma3.allocateCpus("a", {"server": 1})
+    second = arma3.allocateCpus("b", {"server": 1})
+
+    if len(os.sched_getaffinity(0)) >= 2:
+        assert len(first["server"]) == 1 and len(second["server"]) == 1
+        assert first["server"] != second["server"]
+    assert set(arma3.readJsonFile(plan, {})) == set(key for key, allocation in [("a", first), ("b", second)] if allocation["server"])
+
+def test_request_that_does_not_fit_warns(plan, capsys):
+    allocation = arma3.allocateCpus("a", {"server": len(os.sched_getaffinity(0)) + 1})
+
+    assert allocation == {"server": []}
+    assert "running it unpinned" in capsys.readouterr().out
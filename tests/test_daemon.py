@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import subprocess
+
+import pytest
+
+from conftest import arma3, ENV, REPO_DIR
+
+def test_jobs_queue_per_server_and_run_servers_side_by_side(monkeypatch):
+    runs = []
+    lock = threading.Lock()
+
+    def main(argv):
+        start = time.monotonic()
+        time.sleep(0.2)
+        with lock:
+            runs.append((argv[0], start, time.monotonic()))
+
+    monkeypatch.setattr(arma3, "main", main)
+    daemon = arma3.Daemon()
+    jobs = [daemon.submit([server], server, interactive=False) for server in ["a", "a", "b"]]
+    for job in jobs:
+        list(job.follow())
+
+    assert [job.status for job in jobs] == ["done", "done", "done"]
+    (first_a, second_a), b = [run for run in runs if run[0] == "a"], [run for run in runs if run[0] == "b"][0]
+    assert second_a[1] >= first_a[2]  # one after the other
+    assert b[1] < first_a[2]  # while the other server's job runs
+
+def test_failed_job_reports_its_exit_code(monkeypatch):
+    def main(argv):
+        print("going down")
+        exit(3)
+
+    monkeypatch.setattr(arma3, "main", main)
+    job = arma3.Daemon().submit(["x"], "x", interactive=False)
+
+    assert list(job.follow())[-1] == {"exit": 3}
+    assert job.status == "failed"
+
+@pytest.fixture
+def daemon():
+    daemon_run = subprocess.Popen([sys.executable, REPO_DIR + "/arma3.py", "daemon", "run"], env=ENV, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    for i in range(500):
+        if os.path.exists(ENV["ARMA3_DAEMON_SOCKET"]):
+            break
+        time.sleep(0.01)
+
+    yield daemon_run
+
+    daemon_run.send_signal(signal.SIGTERM)
+    daemon_run.wait(timeout=10)
+
+def test_cli_runs_jobs_through_the_daemon_with_warm_sessions(tmp_path, daemon, cli, steamcmd_log):
+    with open(ENV["ARMA3_WORKSHOP_FIXTURE"], "w") as fixture:
+        json.dump({mod_id: {"title": "Daemon Mod", "collection": False, "children": []} for mod_id in ["701", "702"]}, fixture)
+
+    create_run = cli(["create", "daemon-test"], str(tmp_path / "server") + "\n")
+    assert "Server installed successfully" in create_run.stdout
+    os.remove(ENV["BENCH_STEAMCMD_LOG"])
+
+    cli(["mods", "daemon-test", "add", "701"])
+    detach_run = cli(["--detach", "mods", "daemon-test", "add", "702"])
+    job_id = detach_run.stdout.split()[-1]
+    cli(["daemon", "follow", job_id])
+
+    assert os.path.isdir(tmp_path / "server" / arma3.SERVER_MOD_DIR / "702")
+    # both jobs used the same logged in steamcmd
+    assert [entry["cmd"] for entry in steamcmd_log()].count("login") == 1
+    assert "done" in cli(["daemon", "jobs"]).stdout
+
+    cli(["delete", "daemon-test"], "Y\n")
+
+def test_paths_typed_at_the_client_are_relative_to_its_cwd(monkeypatch, tmp_path):
+    paths = []
+    monkeypatch.setattr(arma3, "main", lambda argv: paths.append(arma3.promptPath("Directory? ")))
+    job = arma3.Daemon().submit(["x"], "x", cwd=str(tmp_path))
+    job.answers.put("servers/one")
+
+    list(job.follow())
+
+    assert paths == [str(tmp_path / "servers" / "one")]
+    assert os.getcwd() != str(tmp_path)
@@ -0,0 +1,65 @@
+import os
+import contextlib
+
+from conftest import arma3
+
+def test_sharded_download_merges_every_mod(tmp_path, steamcmd_log):
+    dir = str(tmp_path)
+    mod_ids = [str(100 + i) for i in range(6)]
+
+    results = arma3.getSteamMods("user", "password", mod_ids, dir, workers=3)
+
+    assert results == {mod_id: True for mod_id in mod_ids}
+    for mod_id in mod_ids:
+        assert os.path.isfile(dir + "/" + arma3.SERVER_MOD_DIR + mod_id + "/mod.cpp")
+    assert not os.path.exists(dir + "/" + arma3.SERVER_STAGING_DIR)
+
+    install_dirs = set(entry["args"][0] for entry in steamcmd_log() if entry["cmd"] == "force_install_dir")
+    assert install_dirs == set(dir + "/" + arma3.SERVER_STAGING_DIR + "/" + str(i) for i in range(3))
+
+def test_partial_download_goes_back_to_its_staging_dir(tmp_path, steamcmd_log):
+    dir = str(tmp_path)
+    os.makedirs(dir + "/" + arma3.SERVER_STAGING_DIR + "/7/" + arma3.SERVER_MOD_DOWNLOADS_DIR + "105")
+
+    results = arma3.getSteamMods("user", "password", ["104", "105"], dir, workers=2)
+
+    assert results == {"104": True, "105": True}
+    install_dirs = {}
+    for entry in steamcmd_log():
+        if entry["cmd"] == "force_install_dir":
+            install_dirs[entry["pid"]] = entry["args"][0]
+        if entry["cmd"] == "workshop_download_item" and entry["args"][1] == "105":
+            assert install_dirs[entry["pid"]] == dir + "/" + arma3.SERVER_STAGING_DIR + "/7"
+
+def test_only_failed_mods_are_retried_without_holding_the_lock(tmp_path, monkeypatch, steamcmd_log):
+    monkeypatch.setenv("BENCH_STEAMCMD_SILENT", "602")
+    monkeypatch.setattr(arma3, "STEAM_RETRY_BACKOFF", 0)
+    held = []
+    rounds = []
+
+    @contextlib.contextmanager
+    def lock():
+        held.append(True)
+        try:
+            yield
+        finally:
+            held.pop()
+
+    def sleep(delay):
+        assert held == []
+        monkeypatch.delenv("BENCH_STEAMCMD_SILENT")  # steamcmd comes through on the retry
+
+    def on_success(mod_ids):
+        assert held == [True]
+        rounds.append(mod_ids)
+
+    monkeypatch.setattr(arma3.time, "sleep", sleep)
+    results = arma3.getSteamMods("user", "password", ["601", "602"], str(tmp_path), on_success=on_success, lock=lock)
+
+    assert results == {"601": True, "602": True}
+    assert rounds == [["601"], ["602"]]
+    requests = {}
+    for entry in steamcmd_log():
+        if entry["cmd"] == "workshop_download_item":
+            requests.setdefault(entry["pid"], []).append(entry["args"][1])
+    assert list(requests.values()) == [["601", "602"], ["602"]]
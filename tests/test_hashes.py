@@ -0,0 +1,14 @@
+from conftest import arma3
+
+def test_console_log_written_by_the_server_is_not_hashed(tmp_path):
+    dir = str(tmp_path)
+    (tmp_path / "arma3server_x64").write_text("binary")
+    (tmp_path / arma3.INSTANCE_CONSOLE_LOG).write_text("12:00:00 Server started\n")
+    manifest_file = dir + "/" + arma3.SERVER_HASH_MANIFEST
+    arma3.recordHashManifest(dir, manifest_file, arma3.SERVER_HASH_EXCLUDE)
+
+    with open(dir + "/" + arma3.INSTANCE_CONSOLE_LOG, "a") as log:
+        log.write("12:00:05 Player joined\n")
+
+    assert arma3.verifyHashManifest(dir, manifest_file, arma3.SERVER_HASH_EXCLUDE, quick=True) == []
+    assert arma3.verifyHashManifest(dir, manifest_file, arma3.SERVER_HASH_EXCLUDE) == []
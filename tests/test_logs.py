@@ -0,0 +1,70 @@
+import os
+
+from conftest import arma3
+
+LINES = [
+    " 12:00:01 Mission Altis_Life read from bank.",
+    " 12:00:05 Player Alice connected (id=765).",
+    " 12:00:10 Server load: FPS 45, memory used: 2048 MB, out: 10 Kbps, in: 5 Kbps, NG:0, G:1, BE-NG:0, BE-G:0, Players: 1",
+    " 12:00:12 Error in expression <hint foo>"
+]
+
+def newStats():
+    return {"positions": {}, "summary": arma3.newLogSummary()}
+
+def test_lines_in_every_log_are_counted_once(tmp_path):
+    profile = str(tmp_path / "profile")
+    os.makedirs(profile)
+    for name in ["server.rpt", arma3.INSTANCE_CONSOLE_LOG, arma3.INSTANCE_OUTPUT_LOG]:
+        with open(profile + "/" + name, "w") as log:
+            log.write("\n".join(LINES) + "\n")
+
+    stats = newStats()
+    events = []
+    arma3.collectLogEvents(str(tmp_path), profile, stats, events.append)
+
+    summary = stats["summary"]
+    assert summary["connects"] == 1
+    assert summary["fps_samples"] == 1
+    assert summary["missions"] == 1
+    assert summary["script_errors"] == 1
+    assert len(events) == 4
+
+def test_only_output_log_is_used_without_others(tmp_path):
+    profile = str(tmp_path / "profile")
+    os.makedirs(profile)
+    with open(profile + "/" + arma3.INSTANCE_OUTPUT_LOG, "w") as log:
+        log.write("\n".join(LINES) + "\n")
+
+    stats = newStats()
+    arma3.collectLogEvents(str(tmp_path), profile, stats)
+
+    assert stats["summary"]["connects"] == 1
+    assert stats["summary"]["fps_samples"] == 1
+
+def test_long_line_is_cut_and_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(arma3, "LOG_MAX_LINE", 100)
+    monkeypatch.setattr(arma3, "LOG_CHUNK_SIZE", 64)
+    path = str(tmp_path / "log")
+    with open(path, "w") as log:
+        log.write("a" * 1000)
+
+    position = {"offset": 0}
+    assert [len(line) for line in arma3.readLogFile(path, position)] == [100]
+
+    with open(path, "a") as log:
+        log.write("a" * 1000 + "\nnext\n")
+
+    assert list(arma3.readLogFile(path, position)) == ["next"]
+    assert position["offset"] == os.path.getsize(path)
+
+def test_headless_client_rpt_is_not_the_servers(tmp_path):
+    profile = str(tmp_path / "profile")
+    os.makedirs(profile + "/hc0")
+    with open(profile + "/server.rpt", "w") as log:
+        log.write(LINES[2] + "\n")
+    os.utime(profile + "/server.rpt", (1000, 1000))
+    with open(arma3.getHeadlessProfile(profile, 0) + "/client.rpt", "w") as log:
+        log.write(LINES[0] + "\n")
+
+    assert arma3.getLogSources(str(tmp_path), profile)["rpt"]() == profile + "/server.rpt"
@@ -0,0 +1,34 @@
+import os
+
+from conftest import arma3
+
+def test_lowercases_and_skips_unchanged_dirs(tmp_path):
+    os.makedirs(tmp_path / "Addons" / "Sub")
+    (tmp_path / "Addons" / "Sub" / "Data.PBO").write_text("x")
+    index = {}
+
+    assert arma3.lowercase_all(str(tmp_path), index) == []
+    assert os.listdir(tmp_path / "addons" / "sub") == ["data.pbo"]
+    assert arma3.lowercase_all(str(tmp_path), index) == []
+    assert set(index) == {"", "addons", "addons/sub"}
+
+def test_update_over_lowercased_files_replaces_them(tmp_path):
+    # an in-place update downloads Foo.pbo again next to the foo.pbo of the last pass
+    index = {}
+    (tmp_path / "Foo.pbo").write_text("old")
+    arma3.lowercase_all(str(tmp_path), index)
+    (tmp_path / "Foo.pbo").write_text("new")
+
+    assert arma3.lowercase_all(str(tmp_path), index) == []
+    assert os.listdir(tmp_path) == ["foo.pbo"]
+    assert (tmp_path / "foo.pbo").read_text() == "new"
+
+def test_folder_twins_are_reported(tmp_path):
+    os.makedirs(tmp_path / "Addons")
+    os.makedirs(tmp_path / "addons")
+    (tmp_path / "Keys").write_text("x")
+    os.makedirs(tmp_path / "keys")
+
+    collisions = arma3.lowercase_all(str(tmp_path))
+
+    assert sorted(collisions) == [str(tmp_path / "Addons"), str(tmp_path / "Keys")]
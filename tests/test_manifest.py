@@ -0,0 +1,26 @@
+from conftest import arma3
+
+def test_manifest_knows_mods_from_staging_dirs(tmp_path):
+    dir = str(tmp_path)
+    mod_ids = ["201", "202", "203", "204"]
+
+    arma3.getSteamMods("user", "password", mod_ids, dir, workers=2)
+    arma3.recordModManifest(dir, mod_ids)
+
+    manifest = arma3.readModManifest(dir)
+    for mod_id in mod_ids:
+        assert manifest[mod_id]["timeupdated"] > 0
+        assert manifest[mod_id]["manifest"] != ""
+        assert manifest[mod_id]["size"] == arma3.getDirSize(dir + "/" + arma3.SERVER_MOD_DIR + mod_id)
+
+def test_mod_changed_in_place_is_stale(tmp_path):
+    dir = str(tmp_path)
+    arma3.getSteamMods("user", "password", ["205", "206"], dir)
+    arma3.recordModManifest(dir, ["205", "206"])
+    timestamps = {"205": 0, "206": 0}
+    assert arma3.getStaleMods(dir, ["205", "206"], timestamps) == []
+
+    with open(dir + "/" + arma3.SERVER_MOD_DIR + "205/mod.cpp", "a") as meta:
+        meta.write("// patched\n")
+
+    assert arma3.getStaleMods(dir, ["205", "206"], timestamps) == ["205"]
@@ -0,0 +1,7 @@
+from conftest import arma3
+
+def test_malformed_timestamp_is_ignored(tmp_path):
+    (tmp_path / "mod.cpp").write_text('name = "Some Mod";\n')
+    (tmp_path / "meta.cpp").write_text('publishedid = 123;\ntimestamp = 5x;\n')
+
+    assert arma3.parseModMeta(str(tmp_path)) == {"name": "Some Mod", "publishedid": "123", "timestamp": 0}
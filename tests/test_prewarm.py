@@ -0,0 +1,20 @@
+import os
+
+from conftest import arma3
+
+def makeMod(dir, sizes):
+    os.makedirs(dir + "/@mod/addons")
+    for name, size in sizes.items():
+        with open(dir + "/@mod/addons/" + name, "wb") as pbo:
+            pbo.write(b"x" * size)
+
+def test_smaller_files_after_one_over_budget_are_warmed(tmp_path, monkeypatch):
+    makeMod(str(tmp_path), {"a_big.pbo": 8192, "b_small.pbo": 1024})
+    monkeypatch.setattr(arma3, "getResidentBytes", lambda path, size: 0)
+
+    total, resident, requested = arma3.prewarmMods(str(tmp_path), ["@mod"], 4096)
+
+    assert (total, resident, requested) == (9216, 0, 1024)
+
+def test_file_gone_mid_scan_is_skipped(tmp_path):
+    assert arma3.getResidentBytes(str(tmp_path / "deleted.pbo"), 4096) is None
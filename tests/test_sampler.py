@@ -0,0 +1,26 @@
+import os
+import subprocess
+import collections
+
+from conftest import arma3
+
+def test_process_gone_between_reads_gives_no_sample():
+    process = subprocess.Popen(["sleep", "10"])
+    fds = arma3.openProcFiles(process.pid)
+    assert arma3.sampleProc(fds) is not None
+
+    os.close(fds["status"])  # a read failing part way through a sample
+    assert arma3.sampleProc(fds) is None
+
+    process.kill()
+    process.wait()
+    del fds["status"]
+    arma3.closeProcFiles(fds)
+
+def test_prometheus_labels_are_escaped():
+    sample = {"cpu_ticks": 0, "rss": 1, "peak_rss": 1, "threads": 1, "read_bytes": 0, "write_bytes": 0, "time": 0}
+    sampled = {'a"b\\c\nd': {"pid": 1, "fds": {}, "samples": collections.deque([sample])}}
+
+    metrics = arma3.formatPrometheusMetrics("main", sampled)
+
+    assert 'arma3_instance_threads{server="main",instance="a\\"b\\\\c\\nd"} 1' in metrics.splitlines()
@@ -0,0 +1,78 @@
+import os
+import json
+import subprocess
+
+import pytest
+
+from conftest import arma3, ENV
+
+@pytest.fixture
+def server(tmp_path, cli):
+    with open(ENV["ARMA3_WORKSHOP_FIXTURE"], "w") as fixture:
+        json.dump({"401": {"title": "Staged Mod", "collection": False, "children": [], "updated": 1600000000}}, fixture)
+
+    dir = str(tmp_path / "server")
+    cli(["create", "staged"], dir + "\n")
+    with open(dir + "/arma3server_x64", "w") as binary:
+        binary.write("v1")
+    cli(["mods", "staged", "add", "401"])
+    yield dir
+    cli(["delete", "staged"], "Y\n")
+
+def test_staged_update_switches_and_rolls_back(server, cli):
+    cli(["update", "staged", "--staged", "--force"])
+
+    live = arma3.getLiveDir(server)
+    assert os.path.dirname(live) == server + "/" + arma3.SERVER_VERSIONS_DIR
+    assert os.readlink(server + "/" + arma3.SERVER_PREVIOUS_LINK) == "."
+    # the copy has its own server files, so steamcmd writing them can't touch the running server
+    assert os.stat(live + "/arma3server_x64").st_ino != os.stat(server + "/arma3server_x64").st_ino
+    assert os.path.isfile(live + "/" + arma3.SERVER_MOD_DIR + "401/mod.cpp")
+
+    cli(["update", "staged", "--rollback"])
+
+    assert arma3.getLiveDir(server) == server
+    assert os.path.realpath(server + "/" + arma3.SERVER_PREVIOUS_LINK) == live
+
+def test_in_place_writes_to_linked_files_are_found(tmp_path):
+    os.makedirs(tmp_path / "live" / "mods" / "a")
+    (tmp_path / "live" / "mods" / "a" / "data.pbo").write_text("old")
+    (tmp_path / "live" / "server.bin").write_text("old")
+
+    linked = arma3.cloneTree(str(tmp_path / "live"), str(tmp_path / "copy"), link=["mods"])
+
+    assert list(linked) == ["mods/a/data.pbo"]
+    (tmp_path / "copy" / "server.bin").write_text("new, in place")
+    assert (tmp_path / "live" / "server.bin").read_text() == "old"
+    assert arma3.getChangedFiles(str(tmp_path / "live"), linked) == []
+
+    with open(tmp_path / "copy" / "mods" / "a" / "data.pbo", "a") as data:
+        data.write(" patched in place")
+    assert arma3.getChangedFiles(str(tmp_path / "live"), linked) == ["mods/a/data.pbo"]
+
+def test_interrupted_staging_leaves_nothing_behind(tmp_path, monkeypatch):
+    (tmp_path / "server.bin").write_text("x")
+
+    def interrupt(src, dest):
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(arma3, "cloneFile", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        arma3.stageServerVersion(str(tmp_path), [])
+
+    assert os.listdir(tmp_path / arma3.SERVER_VERSIONS_DIR) == []
+
+def test_prune_keeps_versions_in_use(tmp_path):
+    versions = tmp_path / arma3.SERVER_VERSIONS_DIR
+    for version in ["old", "in-use", "current"]:
+        os.makedirs(versions / version)
+    os.symlink(arma3.SERVER_VERSIONS_DIR + "/current", tmp_path / arma3.SERVER_CURRENT_LINK)
+
+    process = subprocess.Popen(["sleep", "10"], cwd=str(versions / "in-use"))
+    try:
+        arma3.pruneServerVersions(str(tmp_path))
+    finally:
+        process.kill()
+        process.wait()
+
+    assert sorted(os.listdir(versions)) == ["current", "in-use"]
@@ -0,0 +1,55 @@
+import os
+import configparser
+
+from conftest import arma3
+
+def saveServer(db, name, path):
+    serverconfig = configparser.ConfigParser()
+    serverconfig.read_dict({"general": {"name": name, "path": path}, "server": {"mods": "1,2"}, "one": {"path": path + "/one", "port": "2302", "mods": "1"}})
+    return arma3.saveServerConfig(db, {}, serverconfig)
+
+def test_missing_directory_keeps_the_server(tmp_path):
+    db = arma3.openStateDb(str(tmp_path / "state.db"))
+    os.makedirs(tmp_path / "server")
+    saveServer(db, "main", str(tmp_path / "server"))
+
+    os.rename(tmp_path / "server", tmp_path / "unmounted")
+    assert arma3.getServerPathFromName("main", db) is None
+    assert arma3.getServerPathFromName("main", db, available=False) == str(tmp_path / "server")
+
+    os.rename(tmp_path / "unmounted", tmp_path / "server")
+    assert arma3.getServerPathFromName("main", db) == str(tmp_path / "server")
+    assert arma3.loadServerConfig(db, "main")["one"]["mods"] == "1"
+
+def test_create_refuses_a_path_of_another_server(tmp_path, cli):
+    cli(["create", "state-a"], str(tmp_path / "a") + "\n")
+
+    create_run = cli(["create", "state-b"], str(tmp_path / "a") + "\n", check=False)
+
+    assert create_run.returncode == 1
+    assert "already used by server state-a" in create_run.stdout
+
+def test_servers_that_fail_to_import_stay_listed(tmp_path, cli):
+    home = tmp_path / "home"
+    os.makedirs(home / ".config/arma3_wrapper")
+    os.makedirs(tmp_path / "old")
+    with open(tmp_path / "old" / "config.ini", "w") as old_config:
+        old_config.write("[general]\nname = old\npath = %s\n\n[server]\nmods = \n" % (tmp_path / "old"))
+    with open(home / ".config/arma3_wrapper/config.ini", "w") as config:
+        config.write("[steam]\nuser = bench\npassword = bench\n\n[state]\nserverlist = %s,%s\n" % (tmp_path / "unmounted", tmp_path / "old"))
+
+    cli(["--no-daemon"], env={"HOME": str(home)})
+
+    config = configparser.ConfigParser()
+    config.read(home / ".config/arma3_wrapper/config.ini")
+    assert config["state"]["serverlist"] == str(tmp_path / "unmounted")
+
+def test_delete_removes_an_unavailable_server(tmp_path, cli):
+    cli(["create", "state-gone"], str(tmp_path / "gone") + "\n")
+    os.rename(tmp_path / "gone", tmp_path / "elsewhere")
+
+    assert cli(["mods", "state-gone", "list"], check=False).returncode == 1
+    cli(["delete", "state-gone"], "Y\n")
+
+    create_run = cli(["create", "state-gone"], str(tmp_path / "gone") + "\n")
+    assert "already exists" not in create_run.stdout
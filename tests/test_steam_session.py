@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from conftest import arma3
+
+def test_pool_logs_in_again_only_when_install_dir_changes(tmp_path, steamcmd_log):
+    pool = arma3.SteamSessionPool("bench", "password", 1)
+    try:
+        arma3.getSteamMods("bench", "password", ["301"], str(tmp_path / "a"), pool=pool)
+        arma3.getSteamMods("bench", "password", ["303"], str(tmp_path / "a"), pool=pool)
+        arma3.getSteamMods("bench", "password", ["302"], str(tmp_path / "b"), pool=pool)
+        assert arma3.getArmaServer("bench", "password", str(tmp_path / "a"), pool, validate=False) == 0
+    finally:
+        pool.close()
+
+    log = steamcmd_log()
+    assert len(set(entry["pid"] for entry in log)) == 1
+    assert [entry["args"][0] for entry in log if entry["cmd"] == "force_install_dir"] == [str(tmp_path / "a"), str(tmp_path / "b"), str(tmp_path / "a")]
+    assert [entry["cmd"] for entry in log].count("login") == 3
+
+    # steamcmd ignores force_install_dir while logged in
+    logged_in = False
+    for entry in log:
+        if entry["cmd"] == "force_install_dir":
+            assert not logged_in
+        logged_in = entry["cmd"] == "login" or (logged_in and entry["cmd"] != "logout")
+
+    assert os.path.isdir(tmp_path / "a" / arma3.SERVER_MOD_DIR / "301")
+    assert os.path.isdir(tmp_path / "a" / arma3.SERVER_MOD_DIR / "303")
+    assert os.path.isdir(tmp_path / "b" / arma3.SERVER_MOD_DIR / "302")
+    assert not os.path.exists(tmp_path / "a" / arma3.SERVER_MOD_DIR / "302")
+
+def test_one_shot_sets_install_dir_before_login(tmp_path, steamcmd_log):
+    assert arma3.getSteamMods("bench", "password", ["304"], str(tmp_path)) == {"304": True}
+
+    assert [entry["cmd"] for entry in steamcmd_log()][:2] == ["force_install_dir", "login"]
+    assert os.path.isdir(tmp_path / arma3.SERVER_MOD_DIR / "304")
+
+@pytest.mark.parametrize("password", ["pass word", 'pa"ss word'])
+def test_login_passes_passwords_intact(password, steamcmd_log):
+    steam_session = arma3.SteamSession("bench", password)
+    try:
+        assert steam_session.useInstallDir("/tmp/some dir")
+    finally:
+        steam_session.close()
+
+    assert [entry["args"] for entry in steamcmd_log()] == [["/tmp/some dir"], ["bench", password]]
+
+def test_silent_steamcmd_is_given_up_on(tmp_path, monkeypatch):
+    hanging = str(tmp_path / "steamcmd")
+    with open(hanging, "w") as binary:
+        binary.write("#!/bin/sh\nexec sleep 60\n")
+    os.chmod(hanging, 0o755)
+    monkeypatch.setattr(arma3, "BINARY_STEAMCMD", hanging)
+    monkeypatch.setattr(arma3, "STEAM_SESSION_TIMEOUT", 0.2)
+
+    with pytest.raises(EOFError):
+        arma3.SteamSession("bench", "password")
@@ -0,0 +1,70 @@
+import os
+import json
+
+import pytest
+
+from conftest import arma3, ENV
+
+def makeMod(dir, mod_id):
+    path = dir + "/" + arma3.SERVER_MOD_DIR + mod_id
+    os.makedirs(path)
+    with open(path + "/mod.cpp", "w") as meta:
+        meta.write('name = "Shared Mod";\n')
+
+def readRefs(store):
+    with open(store + "/" + arma3.STORE_REFS) as refs:
+        return json.load(refs)
+
+def test_store_copy_is_kept_until_the_last_server_lets_go(tmp_path):
+    store, a, b = str(tmp_path / "store"), str(tmp_path / "a"), str(tmp_path / "b")
+    makeMod(a, "500")
+    makeMod(b, "500")
+    arma3.linkStoreMods(store, a, ["500"])
+    arma3.linkStoreMods(store, b, ["500"])
+
+    assert arma3.unlinkStoreMods(store, a, ["500"]) == (["500"], [])
+    assert os.path.isfile(b + "/" + arma3.SERVER_MOD_DIR + "500/mod.cpp")
+    assert readRefs(store) == {"500": [b]}
+
+    assert arma3.unlinkStoreMods(store, b, ["500"]) == (["500"], ["500"])
+    assert not os.path.exists(store + "/" + arma3.SERVER_MOD_DIR + "500")
+    assert readRefs(store) == {}
+
+def test_mods_the_server_never_used_are_left_alone(tmp_path):
+    store, a, b = str(tmp_path / "store"), str(tmp_path / "a"), str(tmp_path / "b")
+    makeMod(b, "501")
+    arma3.linkStoreMods(store, b, ["501"])
+
+    assert arma3.unlinkStoreMods(store, a, ["501", "999999"]) == ([], [])
+    assert os.path.isdir(store + "/" + arma3.SERVER_MOD_DIR + "501")
+    assert readRefs(store) == {"501": [b]}
+
+@pytest.fixture
+def home(tmp_path):
+    # a home of its own whose config uses a mod store
+    home = str(tmp_path / "home")
+    os.makedirs(home + "/.config/arma3_wrapper")
+    with open(home + "/.config/arma3_wrapper/config.ini", "w") as config:
+        config.write("[steam]\nuser = bench\npassword = bench\n\n[store]\npath = %s\n" % (tmp_path / "store"))
+    with open(ENV["ARMA3_WORKSHOP_FIXTURE"], "w") as fixture:
+        json.dump({"801": {"title": "Shared Mod", "collection": False, "children": []}}, fixture)
+
+    return {"HOME": home}
+
+def test_cli_deletes_release_the_store(tmp_path, home, cli):
+    store = str(tmp_path / "store")
+    for name in ["s1", "s2"]:
+        cli(["create", name], str(tmp_path / name) + "\n", env=home)
+        cli(["mods", name, "add", "801"], env=home)
+    assert sorted(readRefs(store)["801"]) == [str(tmp_path / "s1"), str(tmp_path / "s2")]
+
+    delete_run = cli(["mods", "s1", "delete", "801", "999999"], env=home)
+    assert "Removed 801, the shared copy is still in use" in delete_run.stdout
+    assert "999999" not in delete_run.stdout
+    assert os.path.isdir(store + "/" + arma3.SERVER_MOD_DIR + "801")
+
+    cli(["delete", "s2"], "Y\n", env=home)
+    assert readRefs(store) == {}
+    assert not os.path.exists(store + "/" + arma3.SERVER_MOD_DIR + "801")
+
+    cli(["delete", "s1"], "Y\n", env=home)
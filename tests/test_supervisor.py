@@ -0,0 +1,112 @@
+import os
+import asyncio
+import subprocess
+
+import pytest
+
+from conftest import arma3, ENV
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(arma3, "SUPERVISOR_BACKOFF_BASE", 0.1)
+    os.makedirs(tmp_path / "profile")
+    return str(tmp_path)
+
+def useBinary(monkeypatch, path, script=None):
+    if script is not None:
+        with open(path, "w") as binary:
+            binary.write("#!/bin/sh\n" + script + "\n")
+        os.chmod(path, 0o755)
+    monkeypatch.setattr(arma3, "BINARY_ARMA3SERVER", path)
+
+def supervise(server, until):
+    # supervises instance "one" until until(state) holds, then stops it. returns its state
+    async def run():
+        stopping = asyncio.Event()
+        task = asyncio.ensure_future(arma3.superviseInstance(server, "one", server + "/profile", "2302", [], stopping))
+        for i in range(500):
+            if until(arma3.readInstanceState(server).get("one", {})) or task.done():
+                break
+            await asyncio.sleep(0.01)
+        stopping.set()
+        await asyncio.wait_for(task, 10)
+
+    asyncio.run(run())
+    return arma3.readInstanceState(server)["one"]
+
+def test_crash_is_restarted_with_backoff(server, monkeypatch):
+    useBinary(monkeypatch, server + "/crash", "exit 3")
+
+    state = supervise(server, lambda state: state.get("restarts", 0) >= 3)
+
+    assert state["restarts"] >= 3
+    assert state["returncode"] == 3
+    assert state["status"] == "stopped"
+
+def test_backoff_grows_with_every_failure(server, monkeypatch):
+    useBinary(monkeypatch, server + "/crash", "exit 3")
+    delays = []
+    wait_for = asyncio.wait_for
+
+    async def recordDelay(awaitable, timeout):
+        delays.append(timeout)
+        return await wait_for(awaitable, 0.01)
+
+    monkeypatch.setattr(asyncio, "wait_for", recordDelay)
+    supervise(server, lambda state: state.get("restarts", 0) >= 3)
+
+    assert delays[:3] == [0.1, 0.2, 0.4]
+
+def test_clean_exit_is_not_restarted(server, monkeypatch):
+    useBinary(monkeypatch, server + "/shutdown", "exit 0")
+
+    state = supervise(server, lambda state: False)
+
+    assert state["status"] == "stopped"
+    assert state["desired"] == "stopped"
+    assert state.get("restarts", 0) == 0
+
+def test_missing_binary_backs_off_instead_of_raising(server, monkeypatch):
+    useBinary(monkeypatch, server + "/missing")
+
+    state = supervise(server, lambda state: state.get("restarts", 0) >= 2)
+
+    assert state["restarts"] >= 2
+    assert state["status"] == "stopped"
+
+def test_running_instance_is_stopped_with_the_supervisor(server, monkeypatch):
+    useBinary(monkeypatch, ENV["ARMA3_SERVER_BINARY"])
+
+    state = supervise(server, lambda state: state.get("status") == "running")
+
+    assert state["status"] == "stopped"
+    assert state.get("restarts", 0) == 0
+
+@pytest.mark.parametrize("field", ["supervisor", "pid"])
+def test_live_instance_is_not_started_twice(server, monkeypatch, field):
+    useBinary(monkeypatch, server + "/start", "touch " + server + "/started")
+    sleeper = subprocess.Popen(["sleep", "30"])
+    try:
+        arma3.updateInstanceState(server, "one", status="running", **{field: sleeper.pid})
+
+        state = supervise(server, lambda state: False)
+
+        assert state[field] == sleeper.pid
+        assert not os.path.exists(server + "/started")
+    finally:
+        sleeper.kill()
+        sleeper.wait()
+
+    # a dead one doesn't count
+    assert arma3.claimInstance(server, "one", supervisor=os.getpid()) is None
+
+def test_headless_client_gets_its_own_profile_and_the_password(server):
+    profile = server + "/profile"
+    with open(profile + "/server.cfg", "w") as cfg:
+        cfg.write('passwordAdmin = "admin";\npassword = "secret";\nheadlessClients[] = {"127.0.0.1"};\n')
+
+    command = arma3.getHeadlessCommand(profile, "2302", ["@mod"], 1)
+
+    assert "-profiles=" + profile + "/hc1" in command
+    assert "-password=secret" in command
+    assert "-password=" not in " ".join(arma3.getHeadlessCommand(server + "/missing", "2302", [], 0))
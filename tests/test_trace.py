@@ -0,0 +1,21 @@
+import pytest
+
+from conftest import arma3
+
+@pytest.mark.parametrize("pooled", [False, True])
+def test_items_without_a_result_line_fail(tmp_path, monkeypatch, pooled):
+    monkeypatch.setenv("BENCH_STEAMCMD_SILENT", "502")
+    monkeypatch.setattr(arma3, "STEAM_RETRY_ATTEMPTS", 0)
+    trace = arma3.SteamTrace(str(tmp_path / "trace.jsonl"))
+    pool = arma3.SteamSessionPool("bench", "password") if pooled else None
+
+    try:
+        results = arma3.getSteamMods("bench", "password", ["501", "502"], str(tmp_path), pool=pool, trace=trace)
+    finally:
+        if pool is not None:
+            pool.close()
+
+    assert results == {"501": True, "502": False}
+    assert trace.items["501"]["success"] is True
+    assert trace.items["502"]["success"] is False
+    assert trace.items["502"]["error"] == "no result from steamcmd"
@@ -0,0 +1,19 @@
+from conftest import arma3
+
+FILE_DETAILS = {"publishedfiledetails": [
+    {"publishedfileid": "601", "result": 1, "title": "Pack", "creator_app_id": 766, "consumer_app_id": 107410, "file_size": 0},
+    {"publishedfileid": "602", "result": 1, "title": "Mod", "creator_app_id": 107410, "consumer_app_id": 107410, "file_size": "1024"},
+    {"publishedfileid": "603", "result": 1, "title": "Sizeless", "creator_app_id": 107410, "consumer_app_id": 107410}
+]}
+COLLECTION_DETAILS = {"collectiondetails": [
+    {"publishedfileid": "601", "children": [{"publishedfileid": "603", "sortorder": 2}, {"publishedfileid": "602", "sortorder": 1}]}
+]}
+
+def test_collections_are_told_apart_by_app(monkeypatch, capsys):
+    def post(self, url, count_field, ids):
+        return FILE_DETAILS if url == arma3.STEAM_API_FILE_DETAILS else COLLECTION_DETAILS
+
+    monkeypatch.setattr(arma3.SteamWorkshopSource, "post", post)
+
+    assert arma3.resolveWorkshopItems(["601"], arma3.SteamWorkshopSource(), {}) == ["602", "603"]
+    assert "603 (Sizeless) has no content" in capsys.readouterr().out